@@ -0,0 +1,105 @@
+import numpy as np
+from trajectory_io import load_trajectory
+
+# All trajectories of a trial (the camera's ground truth and the robot's estimates) resampled once onto one
+# shared, uniform time grid, so comparisons between them are plain array arithmetic instead of a timestamp
+# match per sample. Positions are linearly interpolated and headings along the shorter arc. Outside a
+# stream's recorded time range its first or last pose is held, as a nearest-sample match would.
+
+def wrap_angle(angle):
+    # Into [-pi, pi)
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+def interpolate_angle(query, times, angles, wrap=True):
+    # Interpolates the unwrapped headings, so a turn through +-pi goes the short way round. Missing (NaN)
+    # headings are skipped; a stream without any headings gives NaN.
+    valid = ~np.isnan(angles)
+    if not valid.any():
+        return np.full(len(query), np.nan)
+    angle = np.interp(query, times[valid], np.unwrap(angles[valid]))
+    return wrap_angle(angle) if wrap else angle
+
+def trajectory_samples(trajectory):
+    # time, x, y and heading of the first particle of every sample, in time order
+    x, y, t = trajectory.first()
+    order = np.argsort(trajectory.time, kind='stable')
+    return tuple(np.asarray(column, dtype=np.float64)[order] for column in (trajectory.time, x, y, t))
+
+class Aligned:
+    # Reference poses and another stream's poses at the same times
+    def __init__(self, time, reference, other):
+        self.time = time
+        self.reference = reference
+        self.other = other
+
+def covered(query, times, max_gap):
+    # Query times that fall on a sample or between two samples at most max_gap apart, i.e. not in a
+    # dropout (e.g. frames where the camera lost the robot)
+    right = np.searchsorted(times, query)
+    inside = (right > 0) & (right < len(times))
+    right = np.clip(right, 1, max(len(times) - 1, 1))
+    gap = times[right] - times[right - 1]
+    on_sample = np.isin(query, times)
+    return on_sample | (inside & (gap <= max_gap))
+
+class ResampledTrial:
+    # streams maps a name to a trajectory (or a .json/.npz path). The grid covers every stream's time range
+    # at rate samples per second, by default that of the reference stream, and each stream is stored on it
+    # as (x, y, t) arrays. Comparisons are made at the grid times where the reference has data: inside its
+    # time range and not in a gap longer than max_gap seconds (by default three of its sample intervals).
+    def __init__(self, streams, reference, rate=None, max_gap=None):
+        samples = {}
+        for name, stream in streams.items():
+            trajectory = load_trajectory(stream) if isinstance(stream, str) else stream
+            if len(trajectory) == 0:
+                raise ValueError(f"{name} has no samples")
+            samples[name] = trajectory_samples(trajectory)
+
+        self.reference = reference
+        intervals = np.diff(samples[reference][0])
+        reference_interval = float(np.median(intervals)) if len(intervals) else 0.0
+        if rate is None:
+            rate = 1 / reference_interval if reference_interval > 0 else 100.0
+        self.interval = 1 / rate
+        if max_gap is None:
+            max_gap = 3 * (reference_interval or self.interval)
+
+        start = min(times[0] for times, _, _, _ in samples.values())
+        end = max(times[-1] for times, _, _, _ in samples.values())
+        self.time = start + np.arange(int(np.floor((end - start) / self.interval)) + 1) * self.interval
+
+        self.streams = {}
+        # Headings are kept unwrapped on the grid so they can be interpolated again at offsets
+        self._unwrapped = {}
+        for name, (times, x, y, t) in samples.items():
+            self._unwrapped[name] = interpolate_angle(self.time, times, t, wrap=False)
+            self.streams[name] = (np.interp(self.time, times, x), np.interp(self.time, times, y),
+                                  wrap_angle(self._unwrapped[name]))
+
+        self.mask = covered(self.time, samples[reference][0], max_gap)
+        self._aligned = {}
+
+    def names(self):
+        return [name for name in self.streams if name != self.reference]
+
+    def sample(self, name, offset=0.0):
+        # x, y and t of a stream at the comparison times + offset, interpolated between grid points
+        query = self.time[self.mask] + offset
+        x, y, _ = self.streams[name]
+        t = wrap_angle(np.interp(query, self.time, self._unwrapped[name]))
+        return np.interp(query, self.time, x), np.interp(query, self.time, y), t
+
+    def mse(self, name, offset=0.0):
+        # Mean squared position error of a stream against the reference at an offset
+        reference_x, reference_y, _ = self.streams[self.reference]
+        x, y, _ = self.sample(name, offset)
+        return np.mean((reference_x[self.mask] - x)**2 + (reference_y[self.mask] - y)**2)
+
+    def aligned(self, name, offset=0.0):
+        # The reference and a stream at an offset, computed once per (stream, offset) and shared by
+        # everything that evaluates it
+        key = (name, float(offset))
+        if key not in self._aligned:
+            reference = tuple(column[self.mask] for column in self.streams[self.reference])
+            self._aligned[key] = Aligned(self.time[self.mask], reference, self.sample(name, offset))
+        return self._aligned[key]
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from field_tracker import FieldTracker
+from synthetic_video import write_synthetic_video
+
+# Regression check for motion-adaptive decimation: on a clip that is still, then moving, then still, the
+# decimated run has to be back at full rate within one decimation step of the robot starting to move, also
+# with a deep processing window. Exits with status 1 when it isn't.
+
+FPS = 120
+
+def run(video_path, calibration_file, homography_file, cache_dir, **settings):
+    tracker = FieldTracker(calibration_file=calibration_file, homography_file=homography_file, cache_dir=cache_dir,
+                           track=True, **settings)
+    points = tracker.process_video(video_path)
+    return {int(round(time * FPS)): (x, y) for time, x, y in points}
+
+def check_decimation(work_dir, frames, scale, decimate, max_in_flight, tolerance):
+    video_path = os.path.join(work_dir, "still_then_moving.mp4")
+    path_px, (K, D, H) = write_synthetic_video(video_path, frames + 1, scale, fps=FPS)
+    calibration_file = os.path.join(work_dir, "calibration.npz")
+    homography_file = os.path.join(work_dir, "homo.npz")
+    np.savez(calibration_file, K=K, D=D)
+    np.savez(homography_file, H=H)
+    cache_dir = os.path.join(work_dir, "remap_cache")
+
+    full = run(video_path, calibration_file, homography_file, cache_dir, max_in_flight=max_in_flight)
+    decimated = run(video_path, calibration_file, homography_file, cache_dir, decimate=decimate, max_in_flight=max_in_flight)
+
+    common = np.array(sorted(set(full) & set(decimated)))
+    errors = np.array([np.hypot(full[n][0] - decimated[n][0], full[n][1] - decimated[n][1]) for n in common])
+    # Frame n of the output is file frame n + 1, so the motion starts at the output frame where the ground
+    # truth first moves. Interpolating across the start is expected for the frames skipped just before it,
+    # but from the first decimate frames on every frame must be processed at full rate again.
+    onset = int(np.flatnonzero(np.any(np.diff(path_px, axis=0) != 0, axis=1))[0])
+    late = common >= onset + decimate
+    late_errors = errors[late & (common < onset + frames // 4)]
+
+    print(f"{len(common)} of {len(full)} frames compared, motion starts at frame {onset}: "
+          f"max difference {errors[~late].max() * 1000:.2f} mm around the start, "
+          f"{late_errors.max() * 1000:.2f} mm from frame {onset + decimate} on")
+    return late_errors.max() <= tolerance
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that decimation doesn't skip frames after the robot starts moving.")
+    parser.add_argument("--frames", type=int, default=360, help="Length of the synthetic clip in frames.")
+    parser.add_argument("--scale", type=float, default=0.5, help="Resolution relative to the 1920x1440 calibration.")
+    parser.add_argument("--decimate", type=int, default=8, help="Decimation factor to check.")
+    parser.add_argument("--max_in_flight", type=int, default=64, help="Processing window depth, as on a machine with many cores.")
+    parser.add_argument("--tolerance", type=float, default=0.001, help="Largest allowed position difference in meters once the motion has started.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        passed = check_decimation(work_dir, args.frames, args.scale, args.decimate, args.max_in_flight, args.tolerance)
+
+    print("OK" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,158 @@
+import argparse
+import cv2
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from field_tracker import FieldTracker, open_video
+from video_writer import AsyncVideoWriter
+from synthetic_video import write_synthetic_video
+
+# FieldTracker settings for each pipeline mode. 'annotated' also writes a quarter-size debug video
+# the way homography_demo.py does.
+MODES = {
+    "image": dict(),
+    "pyramid": dict(pyramid_scale=4),
+    "track": dict(track=True),
+    "point": dict(mode='point'),
+    "track_decimate": dict(track=True, decimate=8),
+    "annotated": dict(),
+}
+
+RADIUS = 15
+
+def truth_to_field(path_px):
+    # The pipeline reports the top-left corner of the blob's bounding box
+    x = (path_px[:, 0] - RADIUS - 1000) * 1.783207 / 1000
+    y = (path_px[:, 1] - RADIUS - 1000) * -1.783207 / 1000
+    return np.stack([x, y], axis=1)
+
+def peak_rss_mb():
+    # VmHWM belongs to this process image alone, while ru_maxrss also keeps the parent's peak across fork + exec
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_case(video_path, calibration_file, homography_file, cache_dir, mode):
+    # Runs in its own freshly spawned process so the peak RSS belongs to this case alone
+    tracker = FieldTracker(calibration_file=calibration_file, homography_file=homography_file, cache_dir=cache_dir, **MODES[mode])
+
+    cap, frame_size, fps = open_video(video_path)
+    frame_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+    cap.release()
+
+    # Load the fused map before timing, as a warm cache would
+    if tracker.mode == 'image':
+        tracker.maps(frame_size)
+
+    writer = None
+    on_frame = None
+    if mode == "annotated":
+        writer = AsyncVideoWriter(os.path.join(os.path.dirname(video_path), f"annotated_{os.getpid()}.mp4"), fps, scale=4)
+        on_frame = writer.submit
+
+    start = time.perf_counter()
+    points = tracker.process_video(video_path, on_frame=on_frame)
+    if writer is not None:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "points": points,
+        "fps": fps,
+        "frames": frame_total,
+        "elapsed_s": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def position_errors(points, fps, truth):
+    # Frame n of the output is file frame n + 1, because frame 0 is only used to probe the size
+    frame_index = np.rint(points[:, 0] * fps).astype(int) + 1
+    return np.linalg.norm(points[:, 1:] - truth[frame_index], axis=1)
+
+def run_benchmarks(scales, lengths, modes, work_dir):
+    spawn = multiprocessing.get_context('spawn')
+    cache_dir = os.path.join(work_dir, 'remap_cache')
+    results = []
+
+    for scale in scales:
+        for frames in lengths:
+            video_path = os.path.join(work_dir, f"synthetic_{scale}_{frames}.mp4")
+            path_px, (K, D, H) = write_synthetic_video(video_path, frames + 1, scale, radius=RADIUS)
+            calibration_file = video_path.rsplit('.', 1)[0] + "_calibration.npz"
+            homography_file = video_path.rsplit('.', 1)[0] + "_homo.npz"
+            np.savez(calibration_file, K=K, D=D)
+            np.savez(homography_file, H=H)
+            truth = truth_to_field(path_px)
+
+            # Build the fused map here so building it does not count towards the first case's memory
+            cap, frame_size, _ = open_video(video_path)
+            cap.release()
+            FieldTracker(calibration_file=calibration_file, homography_file=homography_file, cache_dir=cache_dir).maps(frame_size)
+
+            for mode in modes:
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                    case = executor.submit(run_case, video_path, calibration_file, homography_file, cache_dir, mode).result()
+
+                errors = position_errors(case["points"], case["fps"], truth)
+                result = {
+                    "scale": scale,
+                    "frames": case["frames"],
+                    "mode": mode,
+                    "fps": case["frames"] / case["elapsed_s"],
+                    "peak_rss_mb": case["peak_rss_mb"],
+                    "detected": len(case["points"]) / case["frames"],
+                    "mean_error_m": float(errors.mean()) if len(errors) else float('nan'),
+                    "max_error_m": float(errors.max()) if len(errors) else float('nan'),
+                }
+                results.append(result)
+                print(f"scale {scale:<4} frames {result['frames']:<5} {mode:<15} {result['fps']:8.1f} fps  "
+                      f"{result['peak_rss_mb']:7.1f} MB  detected {result['detected']:.0%}  "
+                      f"mean error {result['mean_error_m'] * 1000:.2f} mm  max {result['max_error_m'] * 1000:.2f} mm")
+
+    return results
+
+def write_results(path, results):
+    # JSON by default, CSV when the path ends in .csv
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as csvfile:
+            csvwriter = csv.DictWriter(csvfile, fieldnames=list(results[0].keys()))
+            csvwriter.writeheader()
+            csvwriter.writerows(results)
+    else:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tracking pipeline modes on synthetic videos with known ground truth.")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.5, 1.0], help="Video resolutions relative to the 1920x1440 calibration.")
+    parser.add_argument("--frames", type=int, nargs="+", default=[120, 480], help="Video lengths in frames.")
+    parser.add_argument("--modes", type=str, nargs="+", default=list(MODES), choices=list(MODES), help="Pipeline modes to run.")
+    parser.add_argument("--work_dir", type=str, default=None, help="Directory for the generated videos. Defaults to a temporary directory.")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this .json or .csv file.")
+    args = parser.parse_args()
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        results = run_benchmarks(args.scales, args.frames, args.modes, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run_benchmarks(args.scales, args.frames, args.modes, work_dir)
+
+    if args.output:
+        write_results(args.output, results)
+        print(f"Benchmark results saved to {args.output}")
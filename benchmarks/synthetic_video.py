@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from field_tracker import DEFAULT_CALIBRATION_FILE, DEFAULT_HOMOGRAPHY_FILE
+
+# Generate fisheye videos of a bright blob moving over a dark field, rendered through the committed
+# camera intrinsics and homography, together with the ground-truth position of every frame.
+
+def scaled_calibration(scale, calibration_file=DEFAULT_CALIBRATION_FILE, homography_file=DEFAULT_HOMOGRAPHY_FILE):
+    # Scaling the image scales K and the undistorted image by the same factor, so the homography
+    # has to take the scaled undistorted pixels back to the same field plane
+    with np.load(calibration_file) as data:
+        K = data['K'].copy()
+        D = data['D']
+    with np.load(homography_file) as data:
+        H = data['H']
+
+    K[:2] *= scale
+    H = H @ np.diag([1 / scale, 1 / scale, 1])
+    return K, D, H
+
+def raw_to_field_map(K, D, H, frame_size, balance=0.5):
+    # For every raw camera pixel, where it lands on the 2000x2000 field plane
+    w, h = frame_size
+    new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, D, (w, h), np.eye(3), balance=balance)
+
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+    raw = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2)
+    undistorted = cv2.fisheye.undistortPoints(raw, K, D, P=new_K)
+    field = cv2.perspectiveTransform(undistorted.astype(np.float64), H).reshape(h, w, 2).astype(np.float32)
+    return field[..., 0], field[..., 1]
+
+def ground_truth_path(frames, still_fraction=0.25, period=600):
+    # Blob center in field pixels: still, then along a figure-eight, then still again.
+    # One loop of the figure-eight takes period frames, about 1.3 m/s at 120 fps like a driving robot.
+    t = np.arange(frames)
+    start = int(frames * still_fraction)
+    stop = frames - start
+    phase = (np.clip(t, start, stop) - start) * 2 * np.pi / period
+
+    x = 1000 + 600 * np.sin(phase)
+    y = 1000 + 400 * np.sin(2 * phase)
+    return np.stack([x, y], axis=1)
+
+def write_synthetic_video(path, frames, scale=1.0, fps=120, radius=15, native_size=(1920, 1440)):
+    # Returns the blob center path in field pixels and the calibration the video was rendered with
+    frame_size = (int(native_size[0] * scale), int(native_size[1] * scale))
+    K, D, H = scaled_calibration(scale)
+    map_x, map_y = raw_to_field_map(K, D, H, frame_size)
+
+    path_px = ground_truth_path(frames)
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+    field = np.full((2000, 2000, 3), 20, np.uint8)
+    for cx, cy in path_px:
+        field[:] = 20
+        cv2.circle(field, (int(round(cx)), int(round(cy))), radius, (255, 255, 255), -1)
+        out.write(cv2.remap(field, map_x, map_y, cv2.INTER_LINEAR))
+    out.release()
+
+    return path_px, (K, D, H)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic fisheye video of a moving bright blob with known ground truth.")
+    parser.add_argument("--frames", type=int, default=600, help="Number of frames to render.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Resolution relative to the 1920x1440 calibration.")
+    parser.add_argument("--fps", type=float, default=120, help="Frame rate of the video.")
+    parser.add_argument("output", type=str, help="Path of the video to write. The calibration and ground truth are saved next to it.")
+    args = parser.parse_args()
+
+    path_px, (K, D, H) = write_synthetic_video(args.output, args.frames, args.scale, args.fps)
+
+    base = args.output.rsplit('.', 1)[0]
+    np.savez(base + "_calibration.npz", K=K, D=D)
+    np.savez(base + "_homo.npz", H=H)
+    np.save(base + "_truth.npy", path_px)
+
+    print(f"Synthetic video saved to {args.output}")
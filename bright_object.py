@@ -0,0 +1,152 @@
+import cv2
+import numpy as np
+from profiling import timer
+
+# A renderer returns the (x, y, w, h) region of the rectified field image for the current frame,
+# sampled every scale pixels. Renderers let the detector ask for just the pixels it needs instead
+# of a whole 2000x2000 frame.
+
+def remap_renderer(frame, map1, map2):
+    # Only remap the requested part of the fused map, so the cost scales with the region size.
+    # Coarse levels just take every scale-th map entry, so each sample matches the full-resolution pixel.
+    # Regions are remembered, so asking again for the same region (e.g. to save the frame) is free.
+    rendered = {}
+
+    def render(x, y, w, h, scale=1):
+        key = (x, y, w, h, scale)
+        if key not in rendered:
+            sub_map1 = np.ascontiguousarray(map1[y:y + h:scale, x:x + w:scale])
+            sub_map2 = np.ascontiguousarray(map2[y:y + h:scale, x:x + w:scale])
+            with timer.stage("remap"):
+                rendered[key] = cv2.remap(frame, sub_map1, sub_map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        return rendered[key]
+    return render
+
+def find_largest_blob(image, threshold):
+    with timer.stage("threshold"):
+        # Convert the image to grayscale
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        # Apply a threshold to get a binary image
+        _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
+
+    with timer.stage("contours"):
+        # Find contours in the binary image
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    if not contours:
+        return None
+
+    # Get the bounding rectangle for the largest contour
+    return cv2.boundingRect(max(contours, key=cv2.contourArea))
+
+class BrightObjectDetector:
+    # Finds the bounding rectangle of the largest blob brighter than threshold on the field plane.
+    #
+    # With pyramid_scale > 1 the whole field is first searched at 1/pyramid_scale resolution and only
+    # the matching full-resolution patch is searched again. The patch extends the coarse rectangle by
+    # 2 * pyramid_scale pixels and is grown if the blob touches its edge, so the refined rectangle is
+    # the full-resolution one (0 px error). Blobs narrower than about pyramid_scale pixels can be
+    # missed by the coarse search.
+    def __init__(self, field_size=(2000, 2000), threshold=200, pyramid_scale=1):
+        if pyramid_scale < 1:
+            raise ValueError(f"pyramid_scale must be at least 1, got {pyramid_scale}")
+        self.field_size = field_size
+        self.threshold = threshold
+        self.pyramid_scale = pyramid_scale
+
+    def detect(self, render):
+        return self._search_field(render)
+
+    def _search_field(self, render):
+        scale = self.pyramid_scale
+        if scale == 1:
+            return find_largest_blob(render(0, 0, *self.field_size), self.threshold)
+
+        coarse = find_largest_blob(render(0, 0, *self.field_size, scale=scale), self.threshold)
+        if coarse is None:
+            return None
+
+        # Refine in the full-resolution patch around the coarse hit, growing it if the blob is cut off
+        x, y, w, h = (value * scale for value in coarse)
+        margin = 2 * scale
+        while margin < max(self.field_size):
+            rect = self._search_window(render, x - margin, y - margin, w + 2 * margin, h + 2 * margin)
+            if rect is not None:
+                return rect
+            margin *= 2
+
+        return find_largest_blob(render(0, 0, *self.field_size), self.threshold)
+
+    def _search_window(self, render, x, y, w, h):
+        x0 = max(int(x), 0)
+        y0 = max(int(y), 0)
+        x1 = min(int(x + w), self.field_size[0])
+        y1 = min(int(y + h), self.field_size[1])
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        rect = find_largest_blob(render(x0, y0, x1 - x0, y1 - y0), self.threshold)
+        if rect is None:
+            return None
+
+        # A blob cut off by the window edge would report a truncated rectangle, so treat it as lost
+        rx, ry, rw, rh = rect
+        if (rx == 0 and x0 > 0) or (ry == 0 and y0 > 0) or (rx + rw == x1 - x0 and x1 < self.field_size[0]) or (ry + rh == y1 - y0 and y1 < self.field_size[1]):
+            return None
+
+        return rx + x0, ry + y0, rw, rh
+
+# Largest margin searched around the prediction before the tracker falls back to the whole field
+MAX_TRACK_WINDOW = 512
+
+class BrightObjectTracker(BrightObjectDetector):
+    # Once the blob is locked, only a window around its constant-velocity prediction is searched.
+    # The window grows while the blob is lost and falls back to a whole-field search past max_window.
+    def __init__(self, field_size=(2000, 2000), threshold=200, pyramid_scale=1, window=48, max_window=MAX_TRACK_WINDOW, growth=2):
+        # The window has to start out positive and grow, or the search around the prediction never ends
+        if window <= 0:
+            raise ValueError(f"window must be positive, got {window}")
+        if max_window < window:
+            raise ValueError(f"max_window ({max_window}) must be at least window ({window})")
+        if growth <= 1:
+            raise ValueError(f"growth must be greater than 1, got {growth}")
+        super().__init__(field_size, threshold, pyramid_scale)
+        self.window = window
+        self.max_window = max_window
+        self.growth = growth
+
+        # Last bounding rectangle and its per-frame motion, None until the blob is locked
+        self.rect = None
+        self.velocity = (0, 0)
+
+    def reset(self):
+        self.rect = None
+        self.velocity = (0, 0)
+
+    def detect(self, render):
+        if self.rect is not None:
+            x, y, w, h = self.rect
+            predicted_x = x + self.velocity[0]
+            predicted_y = y + self.velocity[1]
+
+            margin = self.window
+            while margin <= self.max_window:
+                rect = self._search_window(render, predicted_x - margin, predicted_y - margin, w + 2 * margin, h + 2 * margin)
+                if rect is not None:
+                    return self._lock(rect)
+                margin *= self.growth
+
+        # Not locked yet, or lost even in the largest window: fall back to the whole field
+        rect = self._search_field(render)
+        if rect is None:
+            self.reset()
+            return None
+
+        return self._lock(rect)
+
+    def _lock(self, rect):
+        if self.rect is not None:
+            self.velocity = (rect[0] - self.rect[0], rect[1] - self.rect[1])
+        self.rect = rect
+        return rect
@@ -0,0 +1,453 @@
+import cv2
+import numpy as np
+import logging
+import os
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+from functools import partial
+from remap_cache import DEFAULT_CACHE_DIR, load_fused_map
+from bright_object import BrightObjectDetector, BrightObjectTracker, remap_renderer
+from live_capture import LatestFrameReader
+from profiling import timer
+from trajectory_io import RecordWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration_data.npz')
+DEFAULT_HOMOGRAPHY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'homo.npz')
+
+def pixel_to_field(x, y):
+    # Convert field-plane pixels to meters from the field center
+    x_transformed = x - 1000
+    y_transformed = y - 1000
+
+    x_final = x_transformed * 1.783207 / 1000
+    y_final = y_transformed * -1.783207 / 1000
+
+    logger.debug("x: %s, y: %s", x_final, y_final)
+
+    return x_final, y_final
+
+# Processors take a raw frame and return (rect, render). rect is the blob's bounding rectangle on the
+# field plane or None, and render is a renderer for the rectified frame (None in point mode), so callers
+# can draw the field plane afterwards without it being rendered for every frame.
+
+def process_frame(frame, map1, map2, detector):
+    # Undistort and undo the perspective shift in a single remap, only for the regions the detector asks for
+    render = remap_renderer(frame, map1, map2)
+    return detector.detect(render), render
+
+def process_frame_points(frame, K, D, new_K, H, frame_size, threshold):
+    # Threshold the raw fisheye frame instead of the rectified one
+    with timer.stage("threshold"):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
+    with timer.stage("contours"):
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    if not contours:
+        return None, None
+
+    # Undistort and warp only the contour outlines, all in a single call
+    with timer.stage("point_transform"):
+        points = np.concatenate(contours).astype(np.float32)
+        undistorted = cv2.fisheye.undistortPoints(points, K, D, P=new_K)
+        warped = cv2.perspectiveTransform(undistorted.astype(np.float64), H)
+
+    best = None
+    best_area = -1
+    start = 0
+    for contour in contours:
+        end = start + len(contour)
+        u = undistorted[start:end].reshape(-1, 2)
+        v = warped[start:end].reshape(-1, 2)
+        start = end
+
+        # Skip blobs the full-frame remap and warpPerspective would have cropped away
+        if (u < 0).any() or (u[:, 0] >= frame_size[0]).any() or (u[:, 1] >= frame_size[1]).any():
+            continue
+        if (v < 0).any() or (v >= 2000).any():
+            continue
+
+        # Pick the largest contour as measured on the field plane, like the image path does
+        area = cv2.contourArea(v.astype(np.float32))
+        if area > best_area:
+            best_area = area
+            best = v
+
+    if best is None:
+        return None, None
+
+    # Top-left corner of the warped bounding box, matching cv2.boundingRect in the image path
+    x, y = np.floor(best.min(axis=0))
+    w, h = np.ceil(best.max(axis=0)) - (x, y)
+
+    return (x, y, w, h), None
+
+class StillnessDetector:
+    # Tracks whether the detected position has stayed within threshold meters for settle_frames frames
+    def __init__(self, threshold, settle_frames):
+        self.threshold = threshold
+        self.settle_frames = settle_frames
+        self.anchor = None
+        self.anchor_frame = 0
+
+    def update(self, frame_count, result):
+        if result is None:
+            # Nothing to compare against while the blob is missing
+            self.anchor = None
+        elif self.anchor is None or math.hypot(result[0] - self.anchor[0], result[1] - self.anchor[1]) > self.threshold:
+            self.anchor = result
+            self.anchor_frame = frame_count
+
+    def is_stationary(self, frame_count):
+        return self.anchor is not None and frame_count - self.anchor_frame >= self.settle_frames
+
+def interpolate_skipped(skipped, before, after):
+    # Fill frames skipped while stationary by interpolating between the processed frames around them.
+    # before and after are (frame_count, x, y) detections
+    filled = []
+    for frame_count in skipped:
+        weight = (frame_count - before[0]) / (after[0] - before[0])
+        x = before[1] + (after[1] - before[1]) * weight
+        y = before[2] + (after[2] - before[2]) * weight
+        filled.append((frame_count, x, y))
+    return filled
+
+def timed_process(process, frame):
+    with timer.stage("process"):
+        return process(frame)
+
+def run_frames(cap, process, frame_count, stop, max_in_flight, max_workers=None, decimate=1, stillness=None, on_frame=None, on_detection=None):
+    # Process frames until stop (or the end of the video), keeping at most max_in_flight frames alive at once.
+    # Results are collected on the calling thread in frame order, so no shared list is touched by the workers.
+    # Detections are returned as (frame_count, x, y) tuples, or handed to on_detection(frame_count, x, y)
+    # in frame order as they are found instead of being kept.
+    #
+    # With decimate > 1, once stillness reports the robot as stationary only every decimate-th frame is
+    # decoded and processed; the others are skipped with grab() and interpolated once the next processed
+    # frame is in. Frames skipped at the very end hold the last detection, since the robot was still then.
+    # Frames skipped next to a frame without a detection are left out.
+    detections = []
+    if on_detection is None:
+        on_detection = lambda *detection: detections.append(detection)
+
+    skipped = deque()
+    last = None
+
+    def collect(frame_count, future):
+        nonlocal last
+        rect, render = future.result()
+        position = pixel_to_field(rect[0], rect[1]) if rect is not None else None
+        if stillness is not None:
+            stillness.update(frame_count, position)
+
+        # Frames are skipped before the next one is submitted, so everything skipped before this frame
+        # lies between it and the previous processed frame
+        gap = []
+        while skipped and skipped[0] < frame_count:
+            gap.append(skipped.popleft())
+
+        detection = (frame_count, *position) if position is not None else None
+        if gap and last is not None and detection is not None:
+            for filled in interpolate_skipped(gap, last, detection):
+                on_detection(*filled)
+        if detection is not None:
+            on_detection(*detection)
+        last = detection
+
+        if on_frame is not None:
+            on_frame(frame_count, render, rect, position)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        while stop is None or frame_count < stop:
+            # Block decoding until the oldest frame is done once the window is full
+            if len(pending) >= max_in_flight:
+                collect(*pending.popleft())
+
+            stationary = decimate > 1 and stillness.is_stationary(frame_count)
+            if stationary and pending:
+                # Decide on the latest processed frame, not one up to max_in_flight frames old, or frames
+                # after the robot starts moving would still be skipped and interpolated across the start
+                while pending:
+                    collect(*pending.popleft())
+                stationary = stillness.is_stationary(frame_count)
+
+            if stationary:
+                ended = False
+                for _ in range(decimate - 1):
+                    if stop is not None and frame_count >= stop:
+                        break
+                    with timer.stage("grab"):
+                        grabbed = cap.grab()
+                    if not grabbed:
+                        ended = True
+                        break
+                    skipped.append(frame_count)
+                    frame_count += 1
+                if ended or (stop is not None and frame_count >= stop):
+                    break
+
+            with timer.stage("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+
+            pending.append((frame_count, executor.submit(timed_process, process, frame)))
+
+            frame_count += 1
+
+        while pending:
+            collect(*pending.popleft())
+
+    if skipped and last is not None:
+        for frame_count in skipped:
+            on_detection(frame_count, last[1], last[2])
+
+    return detections
+
+def open_video(video_path):
+    # Open the video and read frame 0 to get the frame size; processing starts at the next frame
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+
+    ret, frame = cap.read()
+    if not ret:
+        cap.release()
+        raise IOError(f"Could not read frame from video {video_path}")
+
+    h, w = frame.shape[:2]
+    return cap, (w, h), cap.get(cv2.CAP_PROP_FPS)
+
+def process_shard(config, video_path, frame_size, start, stop, profile=False):
+    # Each worker process builds its own tracker and capture, so nothing is shared with the other shards.
+    # Stage timings are recorded per process and handed back to the parent with the detections.
+    if profile:
+        timer.enable()
+
+    tracker = FieldTracker(**config)
+    cap = cv2.VideoCapture(video_path)
+
+    # Frame 0 of the file is only used to probe the size, so frame_count n is file frame n + 1
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start + 1)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start + 1:
+        # Inexact seek for this container, so decode forward from the beginning instead
+        cap.release()
+        cap = cv2.VideoCapture(video_path)
+        for _ in range(start + 1):
+            cap.grab()
+
+    detections = run_frames(cap, tracker.make_processor(frame_size), start, stop, tracker.max_in_flight, max_workers=1, decimate=tracker.decimate, stillness=tracker.make_stillness())
+    cap.release()
+
+    return detections, timer.durations if profile else {}
+
+class FieldTracker:
+    # Loads the calibration and homography once and turns videos of the field into robot positions.
+    #
+    # mode is 'image' (detect on the rectified field plane through the fused remap table) or 'point'
+    # (detect on the raw fisheye frame and only rectify the blob outline). Results are (N, 3) arrays
+    # of time in seconds and x, y in meters from the field center.
+    def __init__(self, calibration_file=DEFAULT_CALIBRATION_FILE, homography_file=DEFAULT_HOMOGRAPHY_FILE, mode='image',
+                 threshold=200, pyramid_scale=1, track=False, track_window=48, decimate=1, motion_threshold=0.01,
+                 settle_frames=30, balance=0.5, cache_dir=DEFAULT_CACHE_DIR, max_in_flight=None):
+        if mode not in ('image', 'point'):
+            raise ValueError(f"Unknown mode {mode!r}, expected 'image' or 'point'")
+        if track and mode != 'image':
+            raise ValueError("Tracking only applies to the rectified image mode")
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+
+        self.config = dict(calibration_file=calibration_file, homography_file=homography_file, mode=mode,
+                           threshold=threshold, pyramid_scale=pyramid_scale, track=track, track_window=track_window,
+                           decimate=decimate, motion_threshold=motion_threshold, settle_frames=settle_frames,
+                           balance=balance, cache_dir=cache_dir, max_in_flight=max_in_flight)
+
+        self.calibration_file = calibration_file
+        self.homography_file = homography_file
+        self.mode = mode
+        self.threshold = threshold
+        self.pyramid_scale = pyramid_scale
+        self.track = track
+        self.track_window = track_window
+        self.decimate = decimate
+        self.motion_threshold = motion_threshold
+        self.settle_frames = settle_frames
+        self.balance = balance
+        self.cache_dir = cache_dir
+        self.max_in_flight = max_in_flight if max_in_flight is not None else 2 * (os.cpu_count() or 1)
+
+        # Load the calibration data
+        with np.load(calibration_file) as data:
+            self.K = data['K']
+            self.D = data['D']
+
+        # Load the homography matrix
+        with np.load(homography_file) as data:
+            self.H = data['H']
+
+        # Fused maps per frame size, built or loaded from the disk cache once and shared by every video
+        self._maps = {}
+        self._maps_lock = threading.Lock()
+
+        # Detectors are built per video; build one now so bad detector settings fail here, before any
+        # output file is opened
+        if mode == 'image':
+            self.make_detector()
+
+    def maps(self, frame_size):
+        with self._maps_lock:
+            if frame_size not in self._maps:
+                self._maps[frame_size] = load_fused_map(self.calibration_file, self.homography_file, frame_size, balance=self.balance, cache_dir=self.cache_dir)
+            return self._maps[frame_size]
+
+    def make_detector(self):
+        if self.track:
+            return BrightObjectTracker(threshold=self.threshold, pyramid_scale=self.pyramid_scale, window=self.track_window)
+        return BrightObjectDetector(threshold=self.threshold, pyramid_scale=self.pyramid_scale)
+
+    def make_processor(self, frame_size):
+        if self.mode == 'point':
+            new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(self.K, self.D, frame_size, np.eye(3), balance=self.balance)
+            return partial(process_frame_points, K=self.K, D=self.D, new_K=new_K, H=self.H, frame_size=frame_size, threshold=self.threshold)
+
+        map1, map2 = self.maps(frame_size)
+        return partial(process_frame, map1=map1, map2=map2, detector=self.make_detector())
+
+    def make_stillness(self):
+        if self.decimate > 1:
+            return StillnessDetector(self.motion_threshold, self.settle_frames)
+        return None
+
+    def process_video(self, video_path, processes=1, on_frame=None, on_position=None):
+        # on_frame(frame_count, render, rect, position) is called in frame order with a renderer for the
+        # rectified frame, so callers can draw or save it. It needs a single process.
+        #
+        # Positions are returned as an (N, 3) array, or, with on_position(time, x, y), handed over in time
+        # order as they come in (per shard with processes > 1) and not kept, in which case None is returned.
+        cap, frame_size, fps = open_video(video_path)
+
+        detections = []
+        if on_position is None:
+            on_detection = None
+        else:
+            def on_detection(frame_count, x, y):
+                on_position(frame_count / fps, x, y)
+
+        # Frames after the probe frame. Streams and some containers don't report a count (0 or negative),
+        # and without one the video can't be split into shards, so it is processed in a single process
+        frame_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1 if processes > 1 else 0
+        if processes > 1 and frame_total < 0:
+            logger.warning("Frame count of %s is unknown, processing it in a single process", video_path)
+
+        if processes > 1 and on_frame is None and frame_total > 0:
+            cap.release()
+
+            # Each shard would start judging stillness afresh, so decimating would give different results
+            # from a single process; sharding already makes up the speed
+            config = self.config
+            if self.decimate > 1:
+                logger.warning("Decimation is turned off when the video is split over processes")
+                config = dict(config, decimate=1)
+
+            # Build the fused map once up front so the workers only memory-map it from the cache
+            if self.mode == 'image':
+                self.maps(frame_size)
+
+            # Split the frames after the probe frame into contiguous ranges; the last one runs to the end of the video
+            bounds = [frame_total * i // processes for i in range(processes + 1)]
+            bounds[-1] = None
+
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [executor.submit(process_shard, config, video_path, frame_size, bounds[i], bounds[i + 1], timer.enabled) for i in range(processes)]
+                for future in futures:
+                    # Shards cover disjoint, increasing ranges, so collecting them in order keeps frame order
+                    shard_detections, durations = future.result()
+                    if on_detection is None:
+                        detections.extend(shard_detections)
+                    else:
+                        for detection in shard_detections:
+                            on_detection(*detection)
+                    for name, values in durations.items():
+                        timer.durations.setdefault(name, []).extend(values)
+        else:
+            process = self.make_processor(frame_size)
+
+            # The tracker carries state from frame to frame, so a single worker keeps frames in order
+            detections = run_frames(cap, process, 0, None, self.max_in_flight, max_workers=1 if self.track else None,
+                                    decimate=self.decimate, stillness=self.make_stillness(), on_frame=on_frame,
+                                    on_detection=on_detection)
+            cap.release()
+
+        if on_position is not None:
+            return None
+
+        points = np.array(detections, dtype=np.float64).reshape(-1, 3)
+        points[:, 0] /= fps
+        return points
+
+    def process_video_to_file(self, video_path, output_path, processes=1, on_frame=None):
+        # Write positions to output_path (.json point data layout or .npz) as they are found, so memory stays
+        # flat and an interrupted run keeps what it had (see RecordWriter). Returns the number of positions.
+        with RecordWriter(output_path) as writer:
+            self.process_video(video_path, processes=processes, on_frame=on_frame, on_position=writer.append_point)
+        return writer.count
+
+    def process_videos(self, video_paths, max_workers=None, output_paths=None):
+        # Run several videos at once; OpenCV releases the GIL while decoding and processing.
+        # With output_paths each video is streamed to its file and the position counts are returned.
+        with ThreadPoolExecutor(max_workers=max_workers or len(video_paths) or 1) as executor:
+            if output_paths is not None:
+                return list(executor.map(self.process_video_to_file, video_paths, output_paths))
+            return list(executor.map(self.process_video, video_paths))
+
+    def track_live(self, source, on_position, realtime=None, stop=None):
+        # Track from a camera index, stream URL or file, always processing the newest frame and dropping
+        # the ones that arrived while the previous frame was being processed.
+        #
+        # on_position(time, x, y, latency) is called as soon as each position is computed. time is seconds
+        # since the first frame was captured and latency is seconds from capture to the position being ready.
+        # Runs until the source ends or stop (a threading.Event) is set and returns the run's statistics.
+        reader = LatestFrameReader(source, realtime=realtime)
+        process = None
+        start = None
+        processed = 0
+        latencies = []
+
+        try:
+            while stop is None or not stop.is_set():
+                item = reader.read(timeout=1)
+                if item is None:
+                    if reader.ended:
+                        break
+                    continue
+
+                frame_index, capture_time, frame = item
+                if process is None:
+                    h, w = frame.shape[:2]
+                    process = self.make_processor((w, h))
+                    start = capture_time
+
+                rect, _ = timed_process(process, frame)
+                processed += 1
+                if rect is None:
+                    continue
+
+                x, y = pixel_to_field(rect[0], rect[1])
+                latency = time.perf_counter() - capture_time
+                latencies.append(latency)
+                on_position(capture_time - start, x, y, latency)
+        finally:
+            reader.release()
+
+        return {
+            "captured": reader.captured,
+            "processed": processed,
+            "dropped": reader.dropped,
+            "latencies": np.array(latencies),
+        }
@@ -0,0 +1,49 @@
+import argparse
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import load_trajectory
+
+# Compare two _point_data files (.json or .npz) frame by frame, e.g. the committed image-path
+# results against a run of post-processing.py --point_only on the same video:
+#
+#   python post-processing.py --point_only --output videos/real/trial1_point_only.json trial1.mov
+#   python graphing/compare_point_data.py videos/real/trial1_point_data.json videos/real/trial1_point_only.json
+
+def read_points(file_path):
+    trajectory = load_trajectory(file_path)
+    x, y, _ = trajectory.first()
+    return np.asarray(trajectory.time), np.stack([x, y], axis=1)
+
+def compare(reference_path, candidate_path, tolerance):
+    ref_times, ref_xy = read_points(reference_path)
+    cand_times, cand_xy = read_points(candidate_path)
+
+    # Both files are sampled at the video frame times, so match each reference frame to the nearest candidate frame
+    index = np.clip(np.searchsorted(cand_times, ref_times), 1, len(cand_times) - 1)
+    left_closer = np.abs(ref_times - cand_times[index - 1]) <= np.abs(cand_times[index] - ref_times)
+    index = np.where(left_closer, index - 1, index)
+    matched = np.abs(cand_times[index] - ref_times) <= tolerance
+
+    errors = np.linalg.norm(ref_xy[matched] - cand_xy[index[matched]], axis=1)
+
+    print(f"Reference frames: {len(ref_times)}, candidate frames: {len(cand_times)}, matched: {int(matched.sum())}")
+    if len(errors) == 0:
+        print("No matching frames")
+        return
+    print(f"Mean error: {errors.mean():.6f} m")
+    print(f"Median error: {np.median(errors):.6f} m")
+    print(f"95th percentile error: {np.percentile(errors, 95):.6f} m")
+    print(f"Max error: {errors.max():.6f} m")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two point data files produced from the same video.")
+    parser.add_argument("--tolerance", type=float, default=1 / 240, help="Maximum time difference in seconds for two samples to count as the same frame.")
+    parser.add_argument("reference", type=str, help="Reference _point_data .json or .npz file.")
+    parser.add_argument("candidate", type=str, help="Point data file to compare against the reference.")
+    args = parser.parse_args()
+
+    compare(args.reference, args.candidate, args.tolerance)
@@ -1,123 +1,384 @@
+import argparse
 import json
+import os
 import sys
 import math
 from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
-import asyncio
 import numpy as np
 from scipy.signal import savgol_filter
+from scipy.fft import rfft, irfft, next_fast_len
+from scipy.optimize import minimize_scalar
 import csv
 
-def read_json_file(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)["data"]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def calculate_distance(point1, point2):
-    return np.sqrt((point1["x"] - point2["x"])**2 + (point1["y"] - point2["y"])**2)
+from trajectory_io import load_trajectory
+from alignment import ResampledTrial
+from trajectory_metrics import evaluate, flatten
+from result_cache import ResultCache, cache_key
 
-def find_closest_point(time, data):
-    times = np.array([point["time"] for point in data])
-    closest_index = np.argmin(np.abs(times - time))
-    return data[closest_index]
+def trajectory_columns(trajectory):
+    # time, x and y of the first particle of every sample
+    x, y, _ = trajectory.first()
+    return np.asarray(trajectory.time), np.asarray(x), np.asarray(y)
+
+def calculate_distance(x1, y1, x2, y2):
+    return np.sqrt((x1 - x2)**2 + (y1 - y2)**2)
+
+class TimeIndex:
+    # Sorted sample times of a trajectory, built once, for nearest-sample lookups with searchsorted.
+    # Like np.argmin over the unsorted times, ties go to the earliest sample.
+    def __init__(self, times):
+        times, self.first = np.unique(np.asarray(times, dtype=np.float64), return_index=True)
+        # -inf and inf on either end give every query a sample on both sides, which is never the closest
+        self.times = np.concatenate(([-np.inf], times, [np.inf]))
+        # Recorded times are normally increasing already, so the sorted position is the sample index
+        self.in_order = bool(np.all(self.first == np.arange(len(self.first))))
+
+    def nearest(self, query):
+        # Index of the sample closest in time to every query time. times[right - 1] < query <= times[right],
+        # so the distances need no abs(), and are exactly the abs(times - query) np.argmin compared.
+        query = np.asarray(query, dtype=np.float64)
+        right = np.searchsorted(self.times, query)
+        left = right - 1
+        take_right = self.times.take(right) - query < query - self.times.take(left)
+        if self.in_order:
+            # On a tie the left sample is the earlier one
+            return left - 1 + take_right
+
+        first = np.concatenate(([0], self.first, [0]))
+        first_left = first.take(left)
+        first_right = first.take(right)
+        tie = (self.times.take(right) - query == query - self.times.take(left)) & (first_right < first_left)
+        return np.where(take_right | tie, first_right, first_left)
+
+def find_closest_point(time, data, index=None):
+    # Index of the sample of data = (time, x, y) closest to time
+    if index is None:
+        index = TimeIndex(data[0])
+    return index.nearest(time)
+
+def calculate_mse_curve(data1, data2, offsets, max_elements=1 << 15):
+    # MSE between data1 and data2 for every offset at once: row k pairs every sample of data1 with the sample
+    # of data2 closest to its time + offsets[k]. Offsets are done in blocks small enough to stay in cache.
+    times1, x1, y1 = data1
+    _, x2, y2 = data2
+    index = TimeIndex(data2[0])
+    block = max(1, max_elements // max(len(times1), 1))
+
+    mse_values = []
+    for first in range(0, len(offsets), block):
+        closest = index.nearest(times1[None, :] + offsets[first:first + block, None])
+        errors = calculate_distance(x1, y1, x2.take(closest), y2.take(closest))**2
+        # Each row is reduced on its own, exactly as np.mean of that row's errors would be
+        mse_values.append(errors.mean(axis=1))
+    return np.concatenate(mse_values) if mse_values else np.zeros(0)
 
 def calculate_mse(data1, data2, offset):
-    errors = []
-    for point1 in data1:
-        closest_point2 = find_closest_point(point1["time"] + offset, data2)
-        error = calculate_distance(point1["data"][0], closest_point2["data"][0])
-        errors.append(error**2)
-    mse = np.mean(errors)
-    return mse
-
-async def find_best_offset(data1, data2, max_offset, step=0.05):
+    return calculate_mse_curve(data1, data2, np.array([offset]))[0]
+
+def find_best_offset(data1, data2, max_offset, step=0.05):
+    # Brute-force search of a fixed offset grid with nearest-sample matching
     offsets = np.arange(-max_offset, max_offset + step, step)
-    min_mse = float('inf')
-    best_offset = 0
-    mse_values = []
+    mse_curve = calculate_mse_curve(data1, data2, offsets)
 
-    with ProcessPoolExecutor() as executor:
-        loop = asyncio.get_event_loop()
-        tasks = [loop.run_in_executor(executor, calculate_mse, data1, data2, offset) for offset in offsets]
-        results = await asyncio.gather(*tasks)
+    # First minimum, as a strict < scan would find
+    best = int(np.argmin(mse_curve))
+    best_offset, min_mse = offsets[best], mse_curve[best]
+    mse_values = list(zip(offsets, mse_curve))
 
-    for offset, mse in zip(offsets, results):
-        mse_values.append((offset, mse))
-        if mse < min_mse:
-            min_mse = mse
-            best_offset = offset
+    return best_offset, min_mse, mse_values
 
-    print(f"Best offset: {best_offset}, MSE: {min_mse}")
-    return best_offset, mse_values
+def xcorr_mse_curve(trial, name, max_offset):
+    # trial.mse(name, offset) for every offset within max_offset that is a whole number of grid steps, from
+    # three FFT cross-correlations on the shared grid: sum |p1 - p2|^2 = sum |p1|^2 - 2 sum p1 . p2 + sum |p2|^2,
+    # with the reference zeroed outside its time range
+    lags = int(np.floor(max_offset / trial.interval + 1e-9))
+    reference_x, reference_y, _ = trial.streams[trial.reference]
+    weight = trial.mask.astype(np.float64)
+    reference_x = reference_x * weight
+    reference_y = reference_y * weight
 
-def plot_error_over_time(time_stamps, errors, label, color):
+    # The stream holds its end values past the grid, as trial.sample() does
+    x, y, _ = trial.streams[name]
+    x = np.pad(x, lags, mode='edge')
+    y = np.pad(y, lags, mode='edge')
+
+    size = next_fast_len(len(x))
+    def correlate(reference, stream):
+        # sum over n of reference[n] * stream[n + j] for j = 0 .. 2 * lags; the padded stream is long enough
+        # that the circular correlation never wraps for these j
+        return irfft(np.conj(rfft(reference, size)) * rfft(stream, size), size)[:2 * lags + 1]
+
+    squares = np.sum(reference_x**2 + reference_y**2)
+    cross = correlate(reference_x, x) + correlate(reference_y, y)
+    power = correlate(weight, x**2 + y**2)
+    offsets = np.arange(-lags, lags + 1) * trial.interval
+    return offsets, (squares - 2 * cross + power) / weight.sum()
+
+def search_offset(trial, name, max_offset, tolerance=1e-6):
+    # Coarse offset from the cross-correlation curve, then a bounded continuous minimisation of trial.mse()
+    # within one grid step either side of it
+    offsets, mse_curve = xcorr_mse_curve(trial, name, max_offset)
+    coarse = offsets[int(np.argmin(mse_curve))]
+    low = max(coarse - trial.interval, -max_offset)
+    high = min(coarse + trial.interval, max_offset)
+    result = minimize_scalar(lambda offset: trial.mse(name, offset), bounds=(low, high),
+                             method='bounded', options={'xatol': tolerance})
+
+    # The refinement can't be worse than the grid point it started from
+    best_offset, min_mse = float(result.x), float(result.fun)
+    coarse_mse = trial.mse(name, coarse)
+    if coarse_mse < min_mse:
+        best_offset, min_mse = float(coarse), coarse_mse
+
+    return best_offset, min_mse, list(zip(offsets, mse_curve))
+
+def plot_error_over_time(time_stamps, errors, label, color, ax=None):
     smoothed_errors = savgol_filter(errors, window_length=40, polyorder=2)
-    plt.plot(time_stamps, smoothed_errors, label=label, color=color)
+    (ax or plt).plot(time_stamps, smoothed_errors, label=label, color=color)
+
+def finish_plot(ax, title='Error Over Time'):
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Error (Distance in meters)')
+    ax.set_title(title)
+    ax.legend()
+    ax.grid(True)
 
 def has_started_moving(data, threshold=0.05):
-    initial_position = data[0]["data"][0]
-    for point in data:
-        if calculate_distance(initial_position, point["data"][0]) > threshold:
-            return point["time"] - 0.5
+    times, x, y = data
+    moved = np.flatnonzero(calculate_distance(x[0], y[0], x, y) > threshold)
+    if len(moved):
+        return times[moved[0]] - 0.5
     return None
 
-async def main():
-    if len(sys.argv) < 4 or len(sys.argv) % 3 != 1:
-        print("Usage: python error.py <ground_truth1.json> <data1.json> <data2.json> [<ground_truth2.json> <data3.json> <data4.json> ...]")
-        sys.exit(1)
+# The two tracked trajectories of every triplet, in command line order
+LABELS = ("Localization", "Exponential")
+COLORS = plt.get_cmap('tab10').colors
 
-    file_triplets = [(sys.argv[i], sys.argv[i + 1], sys.argv[i + 2]) for i in range(1, len(sys.argv), 3)]
-    max_offset = 10  # Define the maximum offset to search
+# Bump when a change to the search or alignment should invalidate cached results
+CACHE_VERSION = 2
 
-    colors = plt.get_cmap('tab10').colors
-    optimal_mse_values = []
+def load_triplet(paths, rate):
+    trajectories = {name: load_trajectory(path) for name, path in zip(("Ground truth",) + LABELS, paths)}
+    # Every comparison works on this one resampling of the triplet
+    return trajectories, ResampledTrial(trajectories, "Ground truth", rate)
 
-    for i, (ground_truth_path, data1_path, data2_path) in enumerate(file_triplets):
-        print(f"Processing triplet {i + 1}: {ground_truth_path}, {data1_path}, {data2_path}")
-        ground_truth_data = read_json_file(ground_truth_path)
-        data1 = read_json_file(data1_path)
-        data2 = read_json_file(data2_path)
+def search_parameters(args):
+    # The settings the chosen search depends on, for the cache key
+    if args.search == "grid":
+        # Nearest-sample matching of the recorded samples, so the resampling rate doesn't enter
+        return {"version": CACHE_VERSION, "search": "grid", "max_offset": args.max_offset, "step": args.step}
+    return {"version": CACHE_VERSION, "search": "xcorr", "max_offset": args.max_offset, "rate": args.rate}
 
-        for j, (data, label, color) in enumerate([(data1, "Localization", colors[0]), (data2, "Exponential", colors[1])]):
-            print(f"Processing {label} for triplet {i + 1}")
-            best_offset, mse_values = await find_best_offset(ground_truth_data, data, max_offset)
+def search_triplet(paths, args):
+    # The expensive part of evaluating a trial: loading, resampling and the offset search. Its result only
+    # depends on the input files and the search settings, so it is what gets cached.
+    trajectories, trial = load_triplet(paths, args.rate)
 
-            # Print MSE values in CSV-like format
-            print(f"Offset,MSE ({label} - Trial {i + 1})")
-            for offset, mse in mse_values:
-                print(f"{offset},{mse}")
+    searches = []
+    for label in LABELS:
+        if args.search == "grid":
+            best_offset, min_mse, mse_values = find_best_offset(trajectory_columns(trajectories["Ground truth"]),
+                                                                trajectory_columns(trajectories[label]), args.max_offset, args.step)
+        else:
+            best_offset, min_mse, mse_values = search_offset(trial, label, args.max_offset)
+        offsets, mse_curve = (np.array(column) for column in zip(*mse_values))
+        searches.append({"label": label, "best_offset": float(best_offset), "mse": float(min_mse),
+                         "curve": (offsets, mse_curve), "aligned": trial.aligned(label, best_offset)})
+    return {"interval": trial.interval, "searches": searches}
 
-            optimal_mse_values.append((f'Trial {i + 1} - {label}', best_offset, min(mse_values, key=lambda x: x[1])[1]))
+def cached_search_triplet(paths, args):
+    # search_triplet() through the on-disk cache, keyed by the files' content and the search settings
+    if args.no_cache:
+        return search_triplet(paths, args), False
 
-            start_time = has_started_moving(ground_truth_data)
-            if start_time is None:
-                print(f"Robot did not start moving in {ground_truth_path}")
-                continue
+    cache = ResultCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+    key = cache_key(paths, search_parameters(args))
+    searched = cache.get(key)
+    if searched is None:
+        searched = search_triplet(paths, args)
+        if args.search == "grid":
+            # The aligned trajectories depend on the rate, which the grid search's key leaves out
+            cache.put(key, {"searches": [{name: value for name, value in search.items() if name != "aligned"}
+                                         for search in searched["searches"]]})
+        else:
+            cache.put(key, searched)
+        return searched, False
 
-            time_stamps = []
-            errors = []
+    if args.search == "grid":
+        # Only the offsets came from the cache; resample at this run's rate to compare at them
+        _, trial = load_triplet(paths, args.rate)
+        searched = {"interval": trial.interval,
+                    "searches": [dict(search, aligned=trial.aligned(search["label"], search["best_offset"]))
+                                 for search in searched["searches"]]}
+    return searched, True
 
-            for point in ground_truth_data:
-                if point["time"] < start_time:
-                    continue
-                closest_point = find_closest_point(point["time"] + best_offset, data)
-                time_stamps.append(point["time"] - start_time)
-                error = calculate_distance(point["data"][0], closest_point["data"][0])
-                errors.append(error)
+def evaluate_triplet(number, paths, args):
+    # Offset search and error over time for one trial's two tracked trajectories against its ground truth.
+    # Runs in a worker process when trials are evaluated in parallel, so everything it returns is plain data
+    # and the per-trial plot is saved here. The metrics are recomputed from the (possibly cached) aligned
+    # arrays, so changing their settings doesn't need a new search.
+    searched, cached = cached_search_triplet(paths, args)
 
-            plot_error_over_time(time_stamps, errors, label=f'Trial {i + 1} - {label}', color=color)
+    results = []
+    for label, search in zip(LABELS, searched["searches"]):
+        aligned = search["aligned"]
+        metrics = evaluate(aligned.time, aligned.reference, aligned.other, searched["interval"], args.rpe_windows,
+                           args.motion_window, args.min_speed)
+        result = {"label": label, "path": paths[LABELS.index(label) + 1], "best_offset": search["best_offset"],
+                  "mse": search["mse"], "metrics": metrics, "curve": search["curve"], "time_stamps": None, "errors": None}
+        results.append(result)
 
-    # Save optimal MSE values to a CSV file
-    with open('optimal_mse_values.csv', 'w', newline='') as csvfile:
+        reference_x, reference_y, _ = aligned.reference
+        x, y, _ = aligned.other
+        start_time = has_started_moving((aligned.time, reference_x, reference_y))
+        if start_time is None:
+            continue
+
+        moving = aligned.time >= start_time
+        result["time_stamps"] = aligned.time[moving] - start_time
+        result["errors"] = calculate_distance(reference_x[moving], reference_y[moving], x[moving], y[moving])
+
+    if args.output_dir:
+        # Worker processes started with spawn (the default on macOS and Windows) re-import this module with
+        # the default backend, so select the headless one here rather than relying on main() having done it
+        if plt.get_backend().lower() != 'agg':
+            plt.switch_backend('Agg')
+        fig, ax = plt.subplots()
+        for j, result in enumerate(results):
+            if result["errors"] is not None:
+                plot_error_over_time(result["time_stamps"], result["errors"], result["label"], COLORS[j], ax)
+        finish_plot(ax, f'Error Over Time - Trial {number}')
+        fig.savefig(os.path.join(args.output_dir, f'trial{number}_error.png'))
+        plt.close(fig)
+
+    return {"trial": number, "ground_truth": paths[0], "cached": cached, "results": results}
+
+def evaluate_triplets(file_triplets, args):
+    # Trials in order, spread over worker processes if asked
+    jobs = [(i + 1, paths, args) for i, paths in enumerate(file_triplets)]
+    processes = min(args.processes, len(jobs))
+    if processes <= 1:
+        for job in jobs:
+            yield evaluate_triplet(*job)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(evaluate_triplet, *zip(*jobs))
+
+def write_summary(directory, evaluations, args):
+    # optimal_mse_values.csv as before, evaluation_metrics.csv and segment_errors.csv, and with an output
+    # directory everything as JSON
+    rows = [(f'Trial {evaluation["trial"]} - {result["label"]}', result["best_offset"], result["mse"])
+            for evaluation in evaluations for result in evaluation["results"]]
+    with open(os.path.join(directory, 'optimal_mse_values.csv'), 'w', newline='') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(['Trial', 'Best Offset', 'Optimal MSE'])
-        csvwriter.writerows(optimal_mse_values)
+        csvwriter.writerows(rows)
+
+    # The other metrics at the best offsets: one row per trajectory, and one per motion segment
+    rows = [dict(Trial=f'Trial {evaluation["trial"]} - {result["label"]}', **flatten(result["metrics"]))
+            for evaluation in evaluations for result in evaluation["results"]]
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    with open(os.path.join(directory, 'evaluation_metrics.csv'), 'w', newline='') as csvfile:
+        csvwriter = csv.DictWriter(csvfile, fieldnames=columns)
+        csvwriter.writeheader()
+        csvwriter.writerows(rows)
+
+    with open(os.path.join(directory, 'segment_errors.csv'), 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(['Trial', 'Segment', 'Start', 'End', 'Moving', 'Samples', 'Mean', 'RMSE', 'Max'])
+        for evaluation in evaluations:
+            for result in evaluation["results"]:
+                for k, segment in enumerate(result["metrics"]["segments"]):
+                    csvwriter.writerow([f'Trial {evaluation["trial"]} - {result["label"]}', k, segment["start"], segment["end"],
+                                        segment["moving"], segment["samples"], segment["mean"], segment["rmse"], segment["max"]])
+
+    if args.output_dir:
+        summary = {
+            "search": {"method": args.search, "max_offset": args.max_offset, "step": args.step, "rate": args.rate},
+            "metrics": {"rpe_windows": args.rpe_windows, "motion_window": args.motion_window, "min_speed": args.min_speed},
+            "trials": [{"trial": evaluation["trial"], "ground_truth": evaluation["ground_truth"],
+                        "results": [{"label": result["label"], "path": result["path"], "best_offset": result["best_offset"],
+                                     "mse": result["mse"], "metrics": result["metrics"]} for result in evaluation["results"]]}
+                       for evaluation in evaluations],
+        }
+        with open(os.path.join(directory, 'optimal_mse_values.json'), 'w') as json_file:
+            json.dump(summary, json_file, indent=4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the time offset between ground truth and tracked trajectories and plot the error over time.")
+    parser.add_argument("--max_offset", type=float, default=10, help="Search offsets within +-max_offset seconds.")
+    parser.add_argument("--search", type=str, default="xcorr", choices=["xcorr", "grid"],
+                        help="xcorr: FFT cross-correlation on the shared time grid and continuous refinement; "
+                             "grid: brute force over a fixed grid with nearest-sample matching of the recorded samples.")
+    parser.add_argument("--rate", type=float, default=None, help="Samples per second of the shared time grid all trajectories are resampled onto; defaults to the ground truth's rate.")
+    parser.add_argument("--step", type=float, default=0.05, help="grid search step in seconds.")
+    parser.add_argument("--curve", action="store_true", help="Print the full MSE-vs-offset curves.")
+    parser.add_argument("--rpe_windows", type=lambda value: [float(window) for window in value.split(',')], default=[1.0],
+                        help="Comma-separated windows in seconds for the relative pose error, e.g. 0.5,1,2.")
+    parser.add_argument("--motion_window", type=float, default=0.5, help="Seconds over which the ground truth's speed and direction of travel are measured.")
+    parser.add_argument("--min_speed", type=float, default=0.05, help="Speed in m/s above which the ground truth counts as moving, for heading and per-segment errors.")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Headless batch mode: save per-trial and combined plots and the CSV/JSON summary here instead of showing the plot.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of trials evaluated at once.")
+    parser.add_argument("--cache_dir", type=str, default=".error_cache", help="Where offset searches and aligned trajectories are cached, keyed by the input files' content and the search settings.")
+    parser.add_argument("--cache_size", type=float, default=500, help="Cache size limit in MB; the least recently used results are dropped beyond it.")
+    parser.add_argument("--no_cache", action="store_true", help="Always recompute, and don't touch the cache.")
+    parser.add_argument("files", type=str, nargs="+", help="Triplets of <ground_truth.json|.npz> <data1.json|.npz> <data2.json|.npz>.")
+    args = parser.parse_args()
+    if len(args.files) % 3 != 0:
+        parser.error("files must come in triplets of ground truth, data1, data2")
+
+    if args.output_dir:
+        # Nothing is shown, so no display is needed; set before any figure exists (workers set it themselves)
+        plt.switch_backend('Agg')
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    file_triplets = [tuple(args.files[i:i + 3]) for i in range(0, len(args.files), 3)]
+
+    evaluations = []
+    for evaluation in evaluate_triplets(file_triplets, args):
+        evaluations.append(evaluation)
+        number = evaluation["trial"]
+        print(f"Processing triplet {number}: {', '.join(file_triplets[number - 1])}" + (" (cached)" if evaluation["cached"] else ""))
+
+        for j, result in enumerate(evaluation["results"]):
+            label = result["label"]
+            print(f"Processing {label} for triplet {number}")
+            print(f"Best offset: {result['best_offset']}, MSE: {result['mse']}")
+            ate, heading = result["metrics"]["ate"], result["metrics"]["heading"]
+            if ate is not None:
+                print(f"ATE RMSE: {ate['rmse']:.4f} m, p95: {ate['p95']:.4f} m, max: {ate['max']:.4f} m")
+            if heading is not None:
+                reverse = f", {heading['reverse_fraction']:.0%} driven in reverse" if "reverse_fraction" in heading else ""
+                print(f"Heading error RMSE: {heading['rmse']:.4f} rad (against the ground truth's {heading['reference']}{reverse})")
+            folded = result["metrics"]["heading_axis_folded"]
+            if folded is not None:
+                print(f"Heading error RMSE to the axis of travel, either direction: {folded['rmse']:.4f} rad")
+
+            if args.curve:
+                # Print MSE values in CSV-like format
+                print(f"Offset,MSE ({label} - Trial {number})")
+                for offset, mse in zip(*result["curve"]):
+                    print(f"{offset},{mse}")
+
+            if result["errors"] is None:
+                print(f"Robot did not start moving in {evaluation['ground_truth']}")
+                continue
+            plot_error_over_time(result["time_stamps"], result["errors"], label=f'Trial {number} - {label}', color=COLORS[j])
+
+    # Save optimal MSE values to a CSV file
+    write_summary(args.output_dir or '.', evaluations, args)
 
-    plt.xlabel('Time')
-    plt.ylabel('Error (Distance in meters)')
-    plt.title('Error Over Time')
-    plt.legend()
-    plt.grid(True)
-    plt.show()
+    finish_plot(plt.gca())
+    if args.output_dir:
+        plt.savefig(os.path.join(args.output_dir, 'error_over_time.png'))
+        print(f"Plots and summary saved to '{args.output_dir}'.")
+    else:
+        plt.show()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
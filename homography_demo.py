@@ -1,140 +1,86 @@
 import cv2
-import numpy as np
-import json
 import argparse
-import os
+import logging
+from field_tracker import FieldTracker, DEFAULT_CALIBRATION_FILE, DEFAULT_HOMOGRAPHY_FILE, open_video
+from remap_cache import DEFAULT_CACHE_DIR
+from video_writer import AsyncVideoWriter
+from profiling import timer
 
-pointData = []
-
-def append_data(time, x, y):
-    pointData.append({
-        "time": time,
-        "data": [
-            {
-                "x": x,
-                "y": y,
-                "t": None
-            }
-        ]
-    })
-
-def detect_bright_objects(frame, frame_count, fps):
-    # Convert the frame to grayscale
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-    # Apply a threshold to get a binary image
-    _, binary = cv2.threshold(gray, 50, 255, cv2.THRESH_BINARY)
-
-    # Find contours in the binary image
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    if contours:
-        # Get the bounding rectangle for the largest contour
-        contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(contour)
-        print(f"Contour location: x={x}, y={y}, width={w}, height={h}")
+def annotate_frame(frame, rect, position, scale):
+    if rect is not None:
+        x, y, w, h = (value // scale for value in rect)
 
         # Draw the bounding rectangle on the original frame
         cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
-        x_transformed = x - 1000
-        y_transformed = y - 1000
-
-        x_final = x_transformed * 1.783207 / 1000
-        y_final = y_transformed * -1.783207 / 1000
-
-        print("x: {}, y: {}".format(x_final, y_final))
-
-        # Append data
-        append_data(frame_count / fps, x_final, y_final)
-
         # Put in the frame
-        cv2.putText(frame, f"x: {x_final:.2f}, y: {y_final:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
+        cv2.putText(frame, f"x: {position[0]:.2f}, y: {position[1]:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
     return frame
 
-def process_frame(frame, frame_count, fps, map1, map2, H):
-    frame = cv2.UMat(frame)
-
-    # Undistort the frame
-    undistorted_frame = cv2.remap(frame, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-
-    # Apply homography to undo perspective shift
-    warped_frame = cv2.warpPerspective(undistorted_frame, H, (2000, 2000))
-
-    return detect_bright_objects(warped_frame, frame_count, fps)
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="Undistort and apply homography to a video.")
-parser.add_argument("--calibration_file", type=str, default=os.path.join(os.path.dirname(__file__), 'calibration_data.npz'), help="Path to the .npz file containing calibration data.")
-parser.add_argument("--homography_file", type=str, default=os.path.join(os.path.dirname(__file__), 'homo.npz'), help="Path to the .npz file containing homography matrix.")
-parser.add_argument("video_path", type=str, help="Path to the video file.")
-args = parser.parse_args()
-
-# Load the calibration data
-with np.load(args.calibration_file) as data:
-    K = data['K']
-    D = data['D']
-
-# Load the homography matrix
-with np.load(args.homography_file) as data:
-    H = data['H']
-
-# Open the video file
-cap = cv2.VideoCapture(args.video_path)
-if not cap.isOpened():
-    print(f"Error: Could not open video {args.video_path}")
-    exit()
-
-# Get the video frame size and FPS
-ret, frame = cap.read()
-if not ret:
-    print("Error: Could not read frame from video.")
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Undistort and apply homography to a video.")
+    parser.add_argument("--calibration_file", type=str, default=DEFAULT_CALIBRATION_FILE, help="Path to the .npz file containing calibration data.")
+    parser.add_argument("--homography_file", type=str, default=DEFAULT_HOMOGRAPHY_FILE, help="Path to the .npz file containing homography matrix.")
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Directory holding the cached undistort+homography remap tables.")
+    parser.add_argument("--threshold", type=int, default=50, help="Grayscale level above which pixels count as part of the bright object.")
+    parser.add_argument("--pyramid_scale", type=int, default=1, help="Search the whole field at 1/N resolution first and refine only the matching full-resolution patch.")
+    parser.add_argument("--preview_scale", type=int, default=1, help="Write the video at 1/N of the 2000x2000 field resolution.")
+    parser.add_argument("--every", type=int, default=1, help="Only write every Nth frame to the video.")
+    parser.add_argument("--no_annotate", action="store_true", help="Write the rectified frames without drawing the detections on them.")
+    parser.add_argument("--format", type=str, default="json", choices=["json", "npz"], help="Format of the point data file; npz is the columnar binary trajectory format.")
+    parser.add_argument("--profile", type=str, default=None, help="Record per-stage timings and write a report to this .json or .csv file.")
+    parser.add_argument("--log_level", type=str, default="INFO", help="Logging level; DEBUG prints every detection.")
+    parser.add_argument("video_path", type=str, help="Path to the video file.")
+    args = parser.parse_args()
+
+    if args.pyramid_scale < 1:
+        parser.error("--pyramid_scale must be at least 1")
+    if args.preview_scale < 1:
+        parser.error("--preview_scale must be at least 1")
+    if args.every < 1:
+        parser.error("--every must be at least 1")
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+    if args.profile:
+        timer.enable()
+
+    tracker = FieldTracker(
+        calibration_file=args.calibration_file,
+        homography_file=args.homography_file,
+        threshold=args.threshold,
+        pyramid_scale=args.pyramid_scale,
+        cache_dir=args.cache_dir,
+    )
+
+    # Get the video FPS
+    try:
+        cap, _, fps = open_video(args.video_path)
+    except IOError as e:
+        print(f"Error: {e}")
+        exit()
     cap.release()
-    exit()
-
-h, w = frame.shape[:2]
-fps = cap.get(cv2.CAP_PROP_FPS)
-
-# Estimate new camera matrix for undistort rectify
-balance = 0.5  # Adjust this value to show more or less of the original image
-new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, D, (w, h), np.eye(3), balance=balance)
-
-# Initialize undistort rectify map
-map1, map2 = cv2.fisheye.initUndistortRectifyMap(K, D, np.eye(3), new_K, (w, h), cv2.CV_16SC2)
-
-# Define the codec and create VideoWriter object
-output_video_path = args.video_path.rsplit('.', 1)[0] + "_processed.mov"
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-out = cv2.VideoWriter(output_video_path, fourcc, fps, (2000, 2000))
-
-# Process the video frames
-frame_count = 0
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    processed_frame = process_frame(frame, frame_count, fps, map1, map2, H)
-    out.write(processed_frame)
 
-    frame_count += 1
+    # Encode on a separate thread so writing the video does not hold up detection
+    output_video_path = args.video_path.rsplit('.', 1)[0] + "_processed.mov"
+    out = AsyncVideoWriter(output_video_path, fps, scale=args.preview_scale, every=args.every, draw=None if args.no_annotate else annotate_frame)
 
-print("Processing complete")
+    # Point data goes out as .npz or .json, appended as the positions come in
+    output_path = args.video_path.rsplit('.', 1)[0] + "_point_data." + args.format
 
-# Release resources
-cap.release()
-out.release()
-cv2.destroyAllWindows()
+    # Process the video frames, writing each rectified frame with its detection drawn on
+    try:
+        tracker.process_video_to_file(args.video_path, output_path, on_frame=out.submit)
+    finally:
+        # Release resources
+        out.close()
 
-# Sort pointData by time
-pointData = sorted(pointData, key=lambda x: x['time'])
+    print("Processing complete")
 
-# Save the point data to a .json file
-output_json_path = args.video_path.rsplit('.', 1)[0] + "_point_data.json"
-with open(output_json_path, 'w') as f:
-    json.dump({"data": pointData}, f, indent=4)
+    print(f"Processed data saved to {output_path}")
+    print(f"Processed video saved to {output_video_path}")
 
-print(f"Processed data saved to {output_json_path}")
-print(f"Processed video saved to {output_video_path}")
\ No newline at end of file
+    if args.profile:
+        timer.write(args.profile)
+        print(f"Profile saved to {args.profile}")
@@ -0,0 +1,86 @@
+import cv2
+import os
+import threading
+import time
+from profiling import timer
+
+def open_source(source):
+    # Camera indices come in as strings from the command line
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video source {source}")
+    return cap
+
+class LatestFrameReader:
+    # Reads a camera, stream or file on a background thread and only keeps the newest frame.
+    # Frames the consumer did not pick up before the next one arrived are dropped and counted.
+    #
+    # With realtime=True frames are released at the source's native fps, so a recorded file
+    # behaves like a live camera. It defaults to on for files and off for cameras and streams.
+    def __init__(self, source, realtime=None):
+        self.cap = open_source(source)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        if realtime is None:
+            realtime = isinstance(source, str) and os.path.isfile(source)
+        self.realtime = realtime
+
+        self.frame = None
+        self.capture_time = None
+        self.frame_index = -1
+        self.captured = 0
+        self.dropped = 0
+        self.ended = False
+
+        self._last_taken = -1
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        index = 0
+        while not self._stopped:
+            if self.realtime:
+                # Hold the frame back until its place in the original timeline
+                delay = start + index / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            with timer.stage("decode"):
+                ret, frame = self.cap.read()
+            capture_time = time.perf_counter()
+            if not ret:
+                break
+
+            with self._condition:
+                if self.frame_index > self._last_taken:
+                    self.dropped += 1
+                self.frame = frame
+                self.capture_time = capture_time
+                self.frame_index = index
+                self.captured += 1
+                self._condition.notify()
+
+            index += 1
+
+        with self._condition:
+            self.ended = True
+            self._condition.notify()
+
+    def read(self, timeout=None):
+        # Wait for a frame newer than the last one returned; None once the source has ended
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.frame_index > self._last_taken or self.ended, timeout):
+                return None
+            if self.frame_index <= self._last_taken:
+                return None
+            self._last_taken = self.frame_index
+            return self.frame_index, self.capture_time, self.frame
+
+    def release(self):
+        self._stopped = True
+        self._thread.join()
+        self.cap.release()
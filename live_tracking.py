@@ -0,0 +1,77 @@
+import argparse
+import json
+import logging
+import sys
+import numpy as np
+from field_tracker import FieldTracker, DEFAULT_CALIBRATION_FILE, DEFAULT_HOMOGRAPHY_FILE
+from trajectory_io import RecordWriter
+from remap_cache import DEFAULT_CACHE_DIR
+from profiling import timer
+
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Track the robot live from a camera, stream or replayed video file.")
+    parser.add_argument("--calibration_file", type=str, default=DEFAULT_CALIBRATION_FILE, help="Path to the .npz file containing calibration data.")
+    parser.add_argument("--homography_file", type=str, default=DEFAULT_HOMOGRAPHY_FILE, help="Path to the .npz file containing homography matrix.")
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Directory holding the cached undistort+homography remap tables.")
+    parser.add_argument("--threshold", type=int, default=200, help="Grayscale level above which pixels count as part of the bright object.")
+    parser.add_argument("--pyramid_scale", type=int, default=1, help="Search the whole field at 1/N resolution first and refine only the matching full-resolution patch.")
+    parser.add_argument("--no_track", action="store_true", help="Search the whole field every frame instead of tracking the blob.")
+    parser.add_argument("--point_only", action="store_true", help="Detect in the raw frame and only undistort and warp the detected blob instead of the whole frame.")
+    parser.add_argument("--fast", action="store_true", help="Read a file as fast as possible instead of at its native fps.")
+    parser.add_argument("--output", type=str, default=None, help="Also save the positions to this _point_data .npz or .json file when the run ends.")
+    parser.add_argument("--profile", type=str, default=None, help="Record per-stage timings and write a report to this .json or .csv file.")
+    parser.add_argument("--log_level", type=str, default="INFO", help="Logging level; DEBUG logs every detection to stderr.")
+    parser.add_argument("source", type=str, help="Camera index, stream URL or video file.")
+    args = parser.parse_args()
+
+    if args.pyramid_scale < 1:
+        parser.error("--pyramid_scale must be at least 1")
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+    if args.profile:
+        timer.enable()
+
+    tracker = FieldTracker(
+        calibration_file=args.calibration_file,
+        homography_file=args.homography_file,
+        mode='point' if args.point_only else 'image',
+        threshold=args.threshold,
+        pyramid_scale=args.pyramid_scale,
+        track=not (args.no_track or args.point_only),
+        cache_dir=args.cache_dir,
+    )
+
+    # Positions are appended to the output file as they come in
+    writer = RecordWriter(args.output) if args.output else None
+
+    def emit(time, x, y, latency):
+        # One JSON object per line so other programs can consume the positions as they arrive
+        print(json.dumps({"time": time, "x": x, "y": y, "latency_ms": latency * 1000}), flush=True)
+        if writer is not None:
+            writer.append_point(time, x, y)
+
+    try:
+        stats = tracker.track_live(args.source, emit, realtime=False if args.fast else None)
+    except IOError as e:
+        if writer is not None:
+            writer.discard()
+        print(f"Error: {e}")
+        exit()
+    except KeyboardInterrupt:
+        print("Cntl+C, exiting", file=sys.stderr)
+        stats = None
+
+    if stats is not None:
+        latencies = stats["latencies"] * 1000
+        print(f"Captured {stats['captured']} frames, processed {stats['processed']}, dropped {stats['dropped']}", file=sys.stderr)
+        if len(latencies):
+            print(f"Latency ms: mean {latencies.mean():.1f}, p50 {np.percentile(latencies, 50):.1f}, p95 {np.percentile(latencies, 95):.1f}, max {latencies.max():.1f}", file=sys.stderr)
+
+    if writer is not None:
+        writer.close()
+        print(f"Processed data saved to {args.output}", file=sys.stderr)
+
+    if args.profile:
+        timer.write(args.profile)
+        print(f"Profile saved to {args.profile}", file=sys.stderr)
@@ -0,0 +1,150 @@
+import numpy as np
+from trajectory_io import Trajectory
+
+# Per-timestep statistics of particle clouds stored the trajectory_io way: flat x, y, t columns with sample i
+# owning particles offsets[i]:offsets[i + 1]. Everything is computed for all timesteps at once; per-timestep
+# sums go through np.bincount, which adds each timestep's particles in order, and per-timestep orderings
+# (median, trimmed mean) through a row-wise sort of the clouds padded to a 2D array.
+
+FIELD_BOUNDS = (-1.8, 1.8, -1.8, 1.8)
+
+ESTIMATORS = ('mean', 'median', 'trimmed_mean')
+HEADINGS = ('circular', 'arithmetic')
+EMPTY_POLICIES = ('drop', 'nan', 'hold')
+
+def segment_ids(offsets):
+    # Timestep index of every particle
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+def bounds_mask(x, y, bounds=FIELD_BOUNDS):
+    # Particles inside the (x_min, x_max, y_min, y_max) field bounds; NaN positions are outside
+    x_min, x_max, y_min, y_max = bounds
+    return (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+
+def _segment_sums(segments, values, count):
+    return np.bincount(segments, weights=values, minlength=count)
+
+def _sorted_rows(segments, values, counts):
+    # Every timestep's values sorted into one row, padded with NaN after the row's count. Sorting many short
+    # rows is much faster than one lexsort by (timestep, value); clouds so uneven that the padding would
+    # dwarf the data go through the lexsort instead.
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    width = int(counts.max()) if len(counts) else 0
+    rows = np.full((len(counts), width), np.nan)
+    if len(counts) * width <= 4 * len(values) + 1024:
+        rows[segments, np.arange(len(values)) - starts[segments]] = values
+        rows.sort(axis=1)
+    else:
+        order = np.lexsort((values, segments))
+        rows[segments[order], np.arange(len(values)) - starts[segments[order]]] = values[order]
+    return rows
+
+def _location(segments, values, counts, estimator, trim):
+    count = len(counts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if estimator == 'mean':
+            return _segment_sums(segments, values, count) / counts
+
+        rows = _sorted_rows(segments, values, counts)
+        if estimator == 'median':
+            if not rows.shape[1]:
+                return np.full(count, np.nan)
+            steps = np.arange(count)
+            low = np.maximum((counts - 1) // 2, 0)
+            return (rows[steps, low] + rows[steps, counts // 2 - (counts == 0)]) / 2
+
+        # Trimmed mean: drop floor(trim * n) particles from each end of every timestep
+        cut = np.floor(trim * counts).astype(np.int64)
+        columns = np.arange(rows.shape[1])
+        kept = (columns >= cut[:, None]) & (columns < (counts - cut)[:, None])
+        return np.where(kept, rows, 0).sum(axis=1) / (counts - 2 * cut)
+
+class CloudSummary:
+    # One estimate per timestep, with
+    #   count              particles that passed the bounds filter
+    #   covariance         (N, 2, 2) sample covariance of x and y (NaN with fewer than two particles)
+    #   heading_variance   circular variance 1 - R of the headings, from 0 (all equal) to 1 (spread out)
+    def __init__(self, time, x, y, t, count, covariance, heading_variance):
+        self.time = time
+        self.x = x
+        self.y = y
+        self.t = t
+        self.count = count
+        self.covariance = covariance
+        self.heading_variance = heading_variance
+
+    def empty(self):
+        return self.count == 0
+
+    def trajectory(self, empty='drop'):
+        # Timesteps whose cloud was filtered out entirely are dropped, kept as NaN, or hold the last estimate
+        if empty not in EMPTY_POLICIES:
+            raise ValueError(f"Unknown empty policy {empty!r}, expected one of {EMPTY_POLICIES}")
+
+        x, y, t = self.x, self.y, self.t
+        if empty == 'drop':
+            keep = ~self.empty()
+            return Trajectory.from_points(self.time[keep], x[keep], y[keep], t[keep])
+
+        if empty == 'hold':
+            source = np.where(self.empty(), 0, np.arange(len(self.time)))
+            source = np.maximum.accumulate(source) if len(source) else source
+            x, y, t = x[source], y[source], t[source]
+            # Nothing to hold before the first non-empty timestep
+            leading = np.cumsum(~self.empty()) == 0
+            x = np.where(leading, np.nan, x)
+            y = np.where(leading, np.nan, y)
+            t = np.where(leading, np.nan, t)
+
+        return Trajectory.from_points(self.time, x, y, t)
+
+def summarize(trajectory, bounds=FIELD_BOUNDS, estimator='mean', trim=0.1, heading='circular'):
+    # Collapse every timestep's particle cloud to one pose. x and y use the estimator; heading is the
+    # circular mean of the particles' headings (or, with heading='arithmetic', the plain mean with missing
+    # headings counted as 0, as average.py used to do). Particles outside bounds are ignored; bounds=None
+    # keeps them all.
+    if estimator not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator {estimator!r}, expected one of {ESTIMATORS}")
+    if heading not in HEADINGS:
+        raise ValueError(f"Unknown heading {heading!r}, expected one of {HEADINGS}")
+    if not 0 <= trim < 0.5:
+        raise ValueError("trim must be in [0, 0.5)")
+
+    steps = len(trajectory)
+    segments = segment_ids(trajectory.offsets)
+    x = np.asarray(trajectory.x)
+    y = np.asarray(trajectory.y)
+    t = np.asarray(trajectory.t)
+
+    if bounds is not None:
+        inside = bounds_mask(x, y, bounds)
+        segments, x, y, t = segments[inside], x[inside], y[inside], t[inside]
+
+    counts = np.bincount(segments, minlength=steps)
+    mean_x = _location(segments, x, counts, estimator, trim)
+    mean_y = _location(segments, y, counts, estimator, trim)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if heading == 'arithmetic':
+            mean_t = _segment_sums(segments, np.nan_to_num(t), steps) / counts
+            heading_variance = np.full(steps, np.nan)
+        else:
+            valid = ~np.isnan(t)
+            sin_sum = _segment_sums(segments[valid], np.sin(t[valid]), steps)
+            cos_sum = _segment_sums(segments[valid], np.cos(t[valid]), steps)
+            valid_counts = np.bincount(segments[valid], minlength=steps)
+            mean_t = np.where(valid_counts > 0, np.arctan2(sin_sum, cos_sum), np.nan)
+            heading_variance = 1 - np.hypot(sin_sum, cos_sum) / valid_counts
+
+        # Sample covariance around the per-timestep mean (not the robust estimate)
+        centre_x = _segment_sums(segments, x, steps) / counts
+        centre_y = _segment_sums(segments, y, steps) / counts
+        dx = x - centre_x[segments]
+        dy = y - centre_y[segments]
+        scale = np.where(counts > 1, 1 / (counts - 1), np.nan)
+        covariance = np.empty((steps, 2, 2))
+        covariance[:, 0, 0] = _segment_sums(segments, dx * dx, steps) * scale
+        covariance[:, 1, 1] = _segment_sums(segments, dy * dy, steps) * scale
+        covariance[:, 0, 1] = covariance[:, 1, 0] = _segment_sums(segments, dx * dy, steps) * scale
+
+    return CloudSummary(np.asarray(trajectory.time), mean_x, mean_y, mean_t, counts, covariance, heading_variance)
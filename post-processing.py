@@ -1,137 +1,81 @@
-import cv2
-import numpy as np
-import json
 import argparse
-from concurrent.futures import ThreadPoolExecutor
+import logging
 import os
-
-pointData = []
-
-def append_data(time, x, y):
-    pointData.append({
-        "time": time,
-        "data": [
-            {
-                "x": x,
-                "y": y,
-                "t": None
-            }
-        ]
-    })
-
-def detect_bright_objects(frame, frame_count, fps):
-    # Convert the frame to grayscale
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-    # Apply a threshold to get a binary image
-    _, binary = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-
-    # Find contours in the binary image
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-    if contours:
-        # Get the bounding rectangle for the largest contour
-        contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(contour)
-        print(f"Contour location: x={x}, y={y}, width={w}, height={h}")
-
-        # Draw the bounding rectangle on the original frame
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-        x_transformed = x - 1000
-        y_transformed = y - 1000
-
-        x_final = x_transformed * 1.783207 / 1000
-        y_final = y_transformed * -1.783207 / 1000
-
-        print("x: {}, y: {}".format(x_final, y_final))
-
-        # Append data
-        append_data(frame_count / fps, x_final, y_final)
-
-        # Put in the frame
-        cv2.putText(frame, f"x: {x_final:.2f}, y: {y_final:.2f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-    return frame
-
-def process_frame(frame, frame_count, fps, map1, map2, H):
-    frame = cv2.UMat(frame)
-
-    # Undistort the frame
-    undistorted_frame = cv2.remap(frame, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
-
-    # Apply homography to undo perspective shift
-    warped_frame = cv2.warpPerspective(undistorted_frame, H, (2000, 2000))
-
-    return detect_bright_objects(warped_frame, frame_count, fps)
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="Undistort and apply homography to a video.")
-parser.add_argument("--calibration_file", type=str, default=os.path.join(os.path.dirname(__file__), 'calibration_data.npz'), help="Path to the .npz file containing calibration data.")
-parser.add_argument("--homography_file", type=str, default=os.path.join(os.path.dirname(__file__), 'homo.npz'), help="Path to the .npz file containing homography matrix.")
-parser.add_argument("video_path", type=str, help="Path to the video file.")
-args = parser.parse_args()
-
-# Load the calibration data
-with np.load(args.calibration_file) as data:
-    K = data['K']
-    D = data['D']
-
-# Load the homography matrix
-with np.load(args.homography_file) as data:
-    H = data['H']
-
-# Open the video file
-cap = cv2.VideoCapture(args.video_path)
-if not cap.isOpened():
-    print(f"Error: Could not open video {args.video_path}")
-    exit()
-
-# Get the video frame size and FPS
-ret, frame = cap.read()
-if not ret:
-    print("Error: Could not read frame from video.")
-    cap.release()
-    exit()
-
-h, w = frame.shape[:2]
-fps = cap.get(cv2.CAP_PROP_FPS)
-
-# Estimate new camera matrix for undistort rectify
-balance = 0.5  # Adjust this value to show more or less of the original image
-new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, D, (w, h), np.eye(3), balance=balance)
-
-# Initialize undistort rectify map
-map1, map2 = cv2.fisheye.initUndistortRectifyMap(K, D, np.eye(3), new_K, (w, h), cv2.CV_16SC2)
-
-# Process the video frames
-frame_count = 0
-with ThreadPoolExecutor() as executor:
-    futures = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        futures.append(executor.submit(process_frame, frame, frame_count, fps, map1, map2, H))
-
-        frame_count += 1
-
-    for future in futures:
-        future.result()
-
-print("Processing complete")
-
-# Release resources
-cap.release()
-cv2.destroyAllWindows()
-
-# Sort pointData by time
-pointData = sorted(pointData, key=lambda x: x['time'])
-
-# Save the point data to a .json file
-output_json_path = args.video_path.rsplit('.', 1)[0] + "_point_data.json"
-with open(output_json_path, 'w') as f:
-    json.dump({"data": pointData}, f, indent=4)
-
-print(f"Processed data saved to {output_json_path}")
\ No newline at end of file
+from field_tracker import FieldTracker, DEFAULT_CALIBRATION_FILE, DEFAULT_HOMOGRAPHY_FILE
+from remap_cache import DEFAULT_CACHE_DIR
+from bright_object import MAX_TRACK_WINDOW
+from profiling import timer
+
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Undistort and apply homography to a video.")
+    parser.add_argument("--calibration_file", type=str, default=DEFAULT_CALIBRATION_FILE, help="Path to the .npz file containing calibration data.")
+    parser.add_argument("--homography_file", type=str, default=DEFAULT_HOMOGRAPHY_FILE, help="Path to the .npz file containing homography matrix.")
+    parser.add_argument("--max_in_flight", type=int, default=2 * (os.cpu_count() or 1), help="Maximum number of decoded frames queued for processing at once.")
+    parser.add_argument("--point_only", action="store_true", help="Detect in the raw frame and only undistort and warp the detected blob instead of the whole frame.")
+    parser.add_argument("--output", type=str, default=None, help="Path of the output .npz or .json file. Defaults to <video>_point_data.<format>.")
+    parser.add_argument("--format", type=str, default="json", choices=["json", "npz"], help="Format of the default output file; npz is the columnar binary trajectory format.")
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR, help="Directory holding the cached undistort+homography remap tables.")
+    parser.add_argument("--threshold", type=int, default=200, help="Grayscale level above which pixels count as part of the bright object.")
+    parser.add_argument("--pyramid_scale", type=int, default=1, help="Search the whole field at 1/N resolution first and refine only the matching full-resolution patch.")
+    parser.add_argument("--track", action="store_true", help="Track the blob and only search a window around its predicted position.")
+    parser.add_argument("--track_window", type=int, default=48, help="Margin in pixels around the predicted blob position searched while tracking.")
+    parser.add_argument("--decimate", type=int, default=1, help="While the robot is stationary, only process every Nth frame and interpolate the rest. Not used with --processes > 1.")
+    parser.add_argument("--motion_threshold", type=float, default=0.01, help="Distance in meters the position must move to count as motion when decimating.")
+    parser.add_argument("--settle_frames", type=int, default=30, help="Number of frames the position must stay still before decimation starts.")
+    parser.add_argument("--processes", type=int, default=1, help="Split the video into this many frame ranges and process them in separate processes.")
+    parser.add_argument("--profile", type=str, default=None, help="Record per-stage timings and write a report to this .json or .csv file.")
+    parser.add_argument("--log_level", type=str, default="INFO", help="Logging level; DEBUG prints every detection.")
+    parser.add_argument("video_path", type=str, nargs="+", help="Path to the video file. Several videos are processed concurrently.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+    if args.profile:
+        timer.enable()
+
+    if args.max_in_flight < 1:
+        parser.error("--max_in_flight must be at least 1")
+    if args.pyramid_scale < 1:
+        parser.error("--pyramid_scale must be at least 1")
+    if not 1 <= args.track_window <= MAX_TRACK_WINDOW:
+        parser.error(f"--track_window must be between 1 and {MAX_TRACK_WINDOW}")
+    if args.track and args.point_only:
+        parser.error("--track only applies to the rectified image mode, not --point_only")
+    if args.output and len(args.video_path) > 1:
+        parser.error("--output can only be used with a single video")
+
+    tracker = FieldTracker(
+        calibration_file=args.calibration_file,
+        homography_file=args.homography_file,
+        mode='point' if args.point_only else 'image',
+        threshold=args.threshold,
+        pyramid_scale=args.pyramid_scale,
+        track=args.track,
+        track_window=args.track_window,
+        decimate=args.decimate,
+        motion_threshold=args.motion_threshold,
+        settle_frames=args.settle_frames,
+        cache_dir=args.cache_dir,
+        max_in_flight=args.max_in_flight,
+    )
+
+    # Point data goes out as .npz or .json, appended as the positions come in
+    output_paths = [args.output or video_path.rsplit('.', 1)[0] + "_point_data." + args.format for video_path in args.video_path]
+
+    try:
+        if len(args.video_path) == 1:
+            counts = [tracker.process_video_to_file(args.video_path[0], output_paths[0], processes=args.processes)]
+        else:
+            counts = tracker.process_videos(args.video_path, output_paths=output_paths)
+    except IOError as e:
+        print(f"Error: {e}")
+        exit()
+
+    print("Processing complete")
+
+    for output_path, count in zip(output_paths, counts):
+        print(f"Processed data saved to {output_path} ({count} positions)")
+
+    if args.profile:
+        timer.write(args.profile)
+        print(f"Profile saved to {args.profile}")
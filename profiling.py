@@ -0,0 +1,72 @@
+import csv
+import json
+import time
+from contextlib import nullcontext
+import numpy as np
+
+_NO_OP = nullcontext()
+
+class _Stage:
+    def __init__(self, durations):
+        self.durations = durations
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.durations.append(time.perf_counter() - self.start)
+
+class StageTimer:
+    # Records wall time per named pipeline stage. While disabled, stage() hands back a shared no-op
+    # context manager, so instrumented code pays one attribute check per stage.
+    def __init__(self):
+        self.enabled = False
+        self.durations = {}
+        self.started = None
+
+    def enable(self):
+        self.enabled = True
+        self.durations = {}
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NO_OP
+        # setdefault is a single dict operation, so worker threads can record stages concurrently
+        return _Stage(self.durations.setdefault(name, []))
+
+    def report(self, frame_stages=("decode", "grab")):
+        wall_time = time.perf_counter() - self.started
+        frames = sum(len(self.durations.get(name, [])) for name in frame_stages)
+        stages = {}
+        for name, durations in self.durations.items():
+            values = np.array(durations) * 1000
+            stages[name] = {
+                "count": len(values),
+                "total_s": float(values.sum() / 1000),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "max_ms": float(values.max()),
+            }
+        return {"wall_time_s": wall_time, "frames": frames, "fps": frames / wall_time if wall_time > 0 else 0.0, "stages": stages}
+
+    def write(self, path):
+        # JSON by default, CSV when the path ends in .csv
+        report = self.report()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as csvfile:
+                csvwriter = csv.writer(csvfile)
+                csvwriter.writerow(['Stage', 'Count', 'Total (s)', 'Mean (ms)', 'P50 (ms)', 'P95 (ms)', 'P99 (ms)', 'Max (ms)'])
+                for name, stats in report["stages"].items():
+                    csvwriter.writerow([name, stats["count"], stats["total_s"], stats["mean_ms"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["max_ms"]])
+                csvwriter.writerow(['total', report["frames"], report["wall_time_s"], '', '', '', '', ''])
+                csvwriter.writerow(['fps', report["fps"], '', '', '', '', '', ''])
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=4)
+        return report
+
+# Shared by every module in the pipeline; scripts turn it on with timer.enable()
+timer = StageTimer()
@@ -1,45 +1,47 @@
-# open a json file selected by the user
-# read the data from the json file
-# for each datapoint in data for each of the times in xy_time_data.json file do the following:
-# take the average of the x and y and t values and resave it to a new json file named {name}_average.json
+# Collapse each timestep's particle cloud in a .json or .npz file to a single pose and save it as
+# {name}_average.json (or .npz). Particles outside the field bounds are ignored. See particle_cloud.py
+# for the estimators; --estimator mean --heading arithmetic gives the old plain averages.
 
-import json
+import argparse
+import os
 import sys
+import time
+import numpy as np
 
-if __name__ == "__main__":
-    for arg in sys.argv[1:]:
-        with open(arg, 'r') as file:
-            xy_time_data = json.load(file)["data"]
-
-        # List to store the average data
-        average_data = []
-
-        for data_point in xy_time_data:
-            average_x = 0
-            average_y = 0
-            average_t = 0
-
-            count = 0
-
-            for item in data_point["data"]:
-                # remove data that is well out of the field
-                if item["x"] < -1.8 or item["x"] > 1.8 or item["y"] < -1.8 or item["y"] > 1.8:
-                    continue
-                count += 1
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-                average_x += item["x"] if isinstance(item["x"], (int, float)) else 0
-                average_y += item["y"] if isinstance(item["y"], (int, float)) else 0
-                average_t += item["t"] if isinstance(item["t"], (int, float)) else 0
+from trajectory_io import load_trajectory, save_trajectory
+from particle_cloud import FIELD_BOUNDS, ESTIMATORS, HEADINGS, EMPTY_POLICIES, summarize
 
-            average_x /= count
-            average_y /= count
-            average_t /= count
-
-            average_data.append({"time": data_point["time"], "data": [{"x": average_x, "y": average_y, "t": average_t}]})
-
-        # Save the average data to a JSON file
-        average_file = f"{arg.split('.')[0]}_average.json"
-        with open(average_file, 'w') as json_file:
-            json.dump({"data": average_data}, json_file, indent=4)
-
-        print(f"Average data saved to '{average_file}'.")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Average the particle cloud of every timestep.")
+    parser.add_argument("--bounds", type=float, nargs=4, default=list(FIELD_BOUNDS), metavar=("X_MIN", "X_MAX", "Y_MIN", "Y_MAX"), help="Field bounds in meters; particles outside are ignored.")
+    parser.add_argument("--estimator", type=str, default="mean", choices=ESTIMATORS, help="Estimator for x and y.")
+    parser.add_argument("--trim", type=float, default=0.1, help="Fraction cut from each end of every timestep by the trimmed mean.")
+    parser.add_argument("--heading", type=str, default="circular", choices=HEADINGS, help="Circular mean of the headings, or the old arithmetic mean.")
+    parser.add_argument("--empty", type=str, default="drop", choices=EMPTY_POLICIES, help="What to do with timesteps that have no particle inside the bounds.")
+    parser.add_argument("--stats", action="store_true", help="Also save per-timestep particle counts, x/y covariance and heading variance to {name}_average_stats.npz.")
+    parser.add_argument("files", type=str, nargs="+", help="Particle data files (.json or .npz).")
+    args = parser.parse_args()
+
+    for arg in args.files:
+        trajectory = load_trajectory(arg)
+
+        start = time.perf_counter()
+        summary = summarize(trajectory, bounds=args.bounds, estimator=args.estimator, trim=args.trim, heading=args.heading)
+        elapsed = time.perf_counter() - start
+
+        empty = int(summary.empty().sum())
+        if empty:
+            print(f"{empty} of {len(trajectory)} timesteps have no particles inside the field bounds ({args.empty})")
+
+        # Save the average data in the input's format (.json or .npz)
+        average_file = f"{arg.split('.')[0]}_average{os.path.splitext(arg)[1]}"
+        save_trajectory(average_file, summary.trajectory(args.empty))
+
+        if args.stats:
+            stats_file = f"{arg.split('.')[0]}_average_stats.npz"
+            np.savez(stats_file, time=summary.time, count=summary.count, covariance=summary.covariance, heading_variance=summary.heading_variance)
+            print(f"Average statistics saved to '{stats_file}'.")
+
+        print(f"Average data saved to '{average_file}' ({len(trajectory)} timesteps in {elapsed * 1000:.1f} ms).")
@@ -0,0 +1,188 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import Trajectory, save_trajectory
+
+# Batch version of log.py + log_split.py: every log is read once, in binary chunks, straight into NumPy
+# columns, and the _processed, _localization, _desired and _localization_average outputs are written from
+# those columns. Logs are spread over worker processes.
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+def _particle_array(items):
+    # None (a missing heading) becomes NaN; anything that isn't rows of three numbers is a ValueError
+    particles = np.array(items, dtype=np.float64)
+    if particles.size == 0:
+        return particles.reshape(0, 3)
+    if particles.ndim != 2 or particles.shape[1] != 3:
+        raise ValueError("particles are not [x, y, t] triples")
+    return particles
+
+def read_log_columns(log_file_path, chunk_size=CHUNK_SIZE):
+    # Parse every {"time": ..., "data": [[x, y, t], ...]} line of a log into time, offsets and an (M, 3)
+    # particle array. Lines log.py would skip are skipped, and lines it would fail on are counted as malformed.
+    times = []
+    counts = []
+    particle_chunks = []
+    malformed = 0
+
+    with open(log_file_path, 'rb') as log_file:
+        remainder = b''
+        while True:
+            chunk = log_file.read(chunk_size)
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop() if chunk else b''
+
+            chunk_times = []
+            chunk_items = []
+            for line in lines:
+                line = line.strip()
+                if not (line.startswith(b'{') and line.endswith(b'}')):
+                    continue
+                try:
+                    data = json.loads(line)
+                    time_stamp = float(data["time"])
+                    items = [item[:3] for item in data["data"]]
+                except (ValueError, KeyError, TypeError, IndexError):
+                    malformed += 1
+                    continue
+                chunk_times.append(time_stamp)
+                chunk_items.append(items)
+
+            try:
+                # One conversion for the whole chunk
+                chunk_particles = _particle_array([item for items in chunk_items for item in items])
+            except (ValueError, TypeError):
+                # Some particle is not three numbers, so convert record by record and drop the bad ones
+                converted = []
+                for time_stamp, items in zip(chunk_times, chunk_items):
+                    try:
+                        converted.append((time_stamp, _particle_array(items)))
+                    except (ValueError, TypeError):
+                        malformed += 1
+                chunk_times = [time_stamp for time_stamp, _ in converted]
+                chunk_items = [record for _, record in converted]
+                chunk_particles = np.concatenate(chunk_items) if converted else np.zeros((0, 3))
+
+            times.extend(chunk_times)
+            counts.extend(len(items) for items in chunk_items)
+            particle_chunks.append(chunk_particles)
+            if not chunk:
+                break
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    particles = np.concatenate(particle_chunks)
+    return np.array(times, dtype=np.float64), offsets, particles, malformed
+
+def split_columns(times, offsets, particles):
+    # log_split.py semantics: all particles but the last are the localization cloud, the last one is the
+    # desired pose, and the average is the cloud's plain mean. Records with a single particle have no
+    # cloud and are left out of the split outputs. The heading is averaged arithmetically on purpose, so
+    # _localization_average files match the ones log_split.py made from older logs; it is wrong for clouds
+    # straddling +-pi, where average.py's circular mean (particle_cloud.py) is the one to use.
+    counts = np.diff(offsets)
+    keep = counts >= 2
+    starts = offsets[:-1][keep]
+    cloud_sizes = counts[keep] - 1
+
+    # Particles of the kept records minus each record's last one
+    in_cloud = np.ones(len(particles), dtype=bool)
+    in_cloud[offsets[1:][counts > 0] - 1] = False
+    in_cloud &= np.repeat(counts >= 2, counts)
+    cloud = particles[in_cloud]
+    cloud_offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(cloud_sizes, out=cloud_offsets[1:])
+
+    desired = particles[starts + cloud_sizes]
+
+    # Sum each cloud particle by particle, in order, across all records at once, so the averages come out
+    # exactly as log_split.py's running sums do. With the records sorted by cloud size, step k only touches
+    # the records that still have a kth particle.
+    sums = np.zeros((len(starts), 3))
+    order = np.argsort(-cloud_sizes, kind='stable')
+    active_counts = np.searchsorted(-cloud_sizes[order], -np.arange(int(cloud_sizes.max()) if len(cloud_sizes) else 0), side='left')
+    for k, active_count in enumerate(active_counts):
+        active = order[:active_count]
+        sums[active] += particles[starts[active] + k]
+    averages = sums / cloud_sizes[:, None]
+
+    kept_times = times[keep]
+    localization = Trajectory(kept_times, cloud_offsets, cloud[:, 0], cloud[:, 1], cloud[:, 2])
+    desired = Trajectory.from_points(kept_times, desired[:, 0], desired[:, 1], desired[:, 2])
+    localization_average = Trajectory.from_points(kept_times, averages[:, 0], averages[:, 1], averages[:, 2])
+    return localization, desired, localization_average, int((~keep).sum())
+
+def ingest_log(log_file_path, output_format="json", split=True):
+    start = time.perf_counter()
+    base_path = log_file_path.rsplit('.', 1)[0]
+    extension = "." + output_format
+
+    times, offsets, particles, malformed = read_log_columns(log_file_path)
+    save_trajectory(base_path + "_processed" + extension, Trajectory(times, offsets, particles[:, 0], particles[:, 1], particles[:, 2]))
+
+    unsplit = 0
+    if split:
+        localization, desired, localization_average, unsplit = split_columns(times, offsets, particles)
+        save_trajectory(base_path + "_localization" + extension, localization)
+        save_trajectory(base_path + "_desired" + extension, desired)
+        save_trajectory(base_path + "_localization_average" + extension, localization_average)
+
+    return {
+        "path": log_file_path,
+        "records": len(times),
+        "particles": len(particles),
+        "malformed": malformed,
+        "unsplit": unsplit,
+        "bytes": os.path.getsize(log_file_path),
+        "seconds": time.perf_counter() - start,
+    }
+
+def expand_paths(patterns):
+    # Globs are expanded here too, for shells that don't
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"No logs match {pattern}", file=sys.stderr)
+        paths.extend(matches)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert many robot logs at once into _processed, _localization, _desired and _localization_average files.")
+    parser.add_argument("--format", type=str, default="json", choices=["json", "npz"], help="Output format; npz is the columnar binary trajectory format.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Number of logs processed at once.")
+    parser.add_argument("--no_split", action="store_true", help="Only write the _processed file for each log.")
+    parser.add_argument("logs", type=str, nargs="+", help="Log files or glob patterns, e.g. 'logs/*.txt'.")
+    args = parser.parse_args()
+
+    paths = expand_paths(args.logs)
+    start = time.perf_counter()
+    results = []
+
+    with ProcessPoolExecutor(max_workers=max(1, min(args.processes, len(paths)))) as executor:
+        futures = {executor.submit(ingest_log, path, args.format, not args.no_split): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except OSError as e:
+                print(f"Error: {futures[future]}: {e}")
+                continue
+            results.append(result)
+            print(f"{result['path']}: {result['records']} records, {result['malformed']} malformed, "
+                  f"{result['unsplit']} unsplit, {result['records'] / result['seconds']:.0f} records/s")
+
+    elapsed = time.perf_counter() - start
+    records = sum(result["records"] for result in results)
+    particles = sum(result["particles"] for result in results)
+    megabytes = sum(result["bytes"] for result in results) / 1e6
+    print(f"Processed {len(results)} logs, {records} records, {particles} particles in {elapsed:.2f}s: "
+          f"{records / elapsed:.0f} records/s, {particles / elapsed:.0f} particles/s, {megabytes / elapsed:.1f} MB/s")
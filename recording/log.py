@@ -1,13 +1,24 @@
 import json
+import os
 import sys
 
-# Function to process the log file and save it to a JSON file
-def process_log_file(log_file_path):
-    # List to store x/y time data
-    xy_time_data = []
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import RecordWriter
+from online_split import SplitWriter
+
+# Function to process the log file and save it to a JSON file.
+# With split=True the localization, desired and localization average files log_split.py would write are
+# produced in the same pass.
+def process_log_file(log_file_path, output_format="json", split=False):
+    base_path = log_file_path.rsplit('.', 1)[0]
 
     try:
         with open(log_file_path, 'r') as log_file:
+            # x/y time data is appended to a .json or .npz file as the lines are read
+            writer = RecordWriter(base_path + "_processed." + output_format)
+            split_writer = SplitWriter(base_path, "." + output_format) if split else None
+
             for line in log_file:
                 line = line.strip()
                 if line.startswith('{') and line.endswith('}'):
@@ -22,8 +33,13 @@ def process_log_file(log_file_path):
                         for item in data["data"]:
                             dataArray.append({"x": item[0], "y": item[1], "t": item[2]})
 
-                        # Append the data to the list
-                        xy_time_data.append({"time": time_stamp, "data": dataArray})
+                        # Append the data to the outputs, the raw record first so it's kept even if it can't be split
+                        writer.append({"time": time_stamp, "data": dataArray})
+                        if split_writer is not None:
+                            try:
+                                split_writer.append({"time": time_stamp, "data": dataArray})
+                            except (ValueError, TypeError) as e:
+                                print(f"Failed to split log line: {e}")
 
                         # Print the received data (optional)
                         print(f"Processed data: time={time_stamp}")
@@ -34,16 +50,19 @@ def process_log_file(log_file_path):
         print(f"Error: File {log_file_path} not found")
         return
 
-    # Save x/y time data to JSON file
-    output_json_path = log_file_path.rsplit('.', 1)[0] + "_processed.json"
-    with open(output_json_path, 'w') as json_file:
-        json.dump({"data": xy_time_data}, json_file, indent=4)
+    writer.close()
+    print(f"x/y time data saved to '{writer.path}'.")
 
-    print(f"x/y time data saved to '{output_json_path}'.")
+    if split_writer is not None:
+        split_writer.close()
+        print(f"Localization data saved to '{split_writer.localization_file}'.")
+        print(f"Desired data saved to '{split_writer.desired_file}'.")
+        print(f"Localization average data saved to '{split_writer.localization_average_file}'.")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python log.py <log_file_path>")
+    args = [arg for arg in sys.argv[1:] if arg != "--split"]
+    if len(args) < 1:
+        print("Usage: python log.py <log_file_path> [json|npz] [--split]")
     else:
-        log_file_path = sys.argv[1]
-        process_log_file(log_file_path)
\ No newline at end of file
+        log_file_path = args[0]
+        process_log_file(log_file_path, *args[1:2], split="--split" in sys.argv)
@@ -1,22 +1,35 @@
+import argparse
 import json
+import os
 import sseclient
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import RecordWriter
+from online_split import SplitWriter
+
+# sse_ingest.py records the same stream with asyncio, reconnecting after drops, and replay_server.py
+# serves a recorded log in place of the robot for testing either
+
 # URL of the SSE endpoint
 sse_url = 'http://192.168.4.1/uart0'
 
 # Function to process the SSE data and save it to a JSON file
-def process_sse_data():
+def process_sse_data(url=sse_url, fileName='xy_time_data.json', split=False):
     # Open a connection to the SSE endpoint
     # response = requests.get(sse_url, stream=True)
     # if response.status_code != 200:
     #     print(f"Error: Unable to connect to {sse_url}, status code: {response.status_code}")
     #     return
 
-    client = sseclient.SSEClient(sse_url)
+    # Output file, .json or the columnar format if the name ends in .npz. With split the localization,
+    # desired and localization average files log_split.py would make are written alongside it as events arrive
+    client = sseclient.SSEClient(url)
 
-    # List to store x/y time data
-    xy_time_data = []
+    # Append x/y time data to the file's journal as it arrives instead of keeping it all in memory
+    writer = RecordWriter(fileName)
+    split_writer = SplitWriter(*os.path.splitext(fileName)) if split else None
 
     print("client connected")
 
@@ -33,8 +46,13 @@ def process_sse_data():
                 for item in data["data"]:
                     dataArray.append({"x": item[0], "y": item[1], "t": item[2]})
 
-                # Append the data to the list
-                xy_time_data.append({"time": time_stamp, "data": dataArray})
+                # Append the data to the journals, the raw record first so it's kept even if it can't be split
+                writer.append({"time": time_stamp, "data": dataArray})
+                if split_writer is not None:
+                    try:
+                        split_writer.append({"time": time_stamp, "data": dataArray})
+                    except (ValueError, TypeError) as e:
+                        print(f"Failed to split SSE event: {e}")
 
                 # Print the received data (optional)
                 print(f"Received data: time={time_stamp}")
@@ -45,15 +63,21 @@ def process_sse_data():
     except KeyboardInterrupt:
         print("Cntl+C, exiting")
 
-    # Save x/y time data to JSON file
-    fileName = 'xy_time_data.json'
-    if len(sys.argv) > 1:
-        fileName = sys.argv[1]
-
-    with open(fileName, 'w') as json_file:
-        json.dump({"data": xy_time_data}, json_file, indent=4)
-
+    # Turn the journals into the final files
+    writer.close()
     print(f"x/y time data saved to '{fileName}'.")
 
+    if split_writer is not None:
+        split_writer.close()
+        print(f"Localization data saved to '{split_writer.localization_file}'.")
+        print(f"Desired data saved to '{split_writer.desired_file}'.")
+        print(f"Localization average data saved to '{split_writer.localization_average_file}'.")
+
 if __name__ == "__main__":
-    process_sse_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Record the robot's SSE telemetry.")
+    parser.add_argument("--url", type=str, default=sse_url, help="SSE endpoint, e.g. a replay_server.py address.")
+    parser.add_argument("--split", action="store_true", help="Also write the localization, desired and localization average files log_split.py would make.")
+    parser.add_argument("output", type=str, nargs="?", default="xy_time_data.json", help="Output .json or .npz file.")
+    args = parser.parse_args()
+
+    process_sse_data(args.url, args.output, args.split)
\ No newline at end of file
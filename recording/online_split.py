@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import RecordWriter
+
+class SplitWriter:
+    # Splits each {"time", "data": [particle, ..., desired]} record as it arrives, the way log_split.py does:
+    # every particle but the last is the localization cloud, the last one is the desired pose, and the
+    # localization average is the plain mean of the cloud's x, y and t. The three outputs are appended to
+    # <base_path>_localization, _desired and _localization_average (.json or .npz), so nothing has to
+    # re-read the recording afterwards.
+    def __init__(self, base_path, extension='.json'):
+        self.localization_file = f"{base_path}_localization{extension}"
+        self.desired_file = f"{base_path}_desired{extension}"
+        self.localization_average_file = f"{base_path}_localization_average{extension}"
+
+        self.localization = RecordWriter(self.localization_file)
+        self.desired = RecordWriter(self.desired_file)
+        self.localization_average = RecordWriter(self.localization_average_file)
+
+    def append(self, record):
+        particles = record["data"][0:-1]
+        if not particles:
+            raise ValueError(f"Record at time {record['time']} has no localization particles")
+
+        # Find the average x, y, t for the localization data, summing in order like log_split.py. t is a
+        # plain mean on purpose, so the output matches log_split.py's for older logs; it is wrong for clouds
+        # straddling +-pi, where average.py's circular mean (particle_cloud.py) is the one to use.
+        x_sum = 0
+        y_sum = 0
+        t_sum = 0
+
+        for item in particles:
+            x_sum += item["x"]
+            y_sum += item["y"]
+            t_sum += item["t"]
+
+        x_avg = x_sum / len(particles)
+        y_avg = y_sum / len(particles)
+        t_avg = t_sum / len(particles)
+
+        self.localization.append({"time": record["time"], "data": particles})
+        self.desired.append({"time": record["time"], "data": [record["data"][-1]]})
+        self.localization_average.append({"time": record["time"], "data": [{"x": x_avg, "y": y_avg, "t": t_avg}]})
+
+    def close(self):
+        self.localization.close()
+        self.desired.close()
+        self.localization_average.close()
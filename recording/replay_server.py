@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import Trajectory, load_trajectory
+from batch_ingest import read_log_columns
+
+# Local stand-in for the robot's SSE endpoint, for testing main.py and sse_ingest.py without the robot.
+# Replays a recorded log (the lines log.py reads) or a .json/.npz trajectory file as events in the robot's
+# format, data: {"time": ..., "data": [[x, y, t], ...]}, numbered with id: so clients can resume with
+# Last-Event-ID. Malformed events and dropped connections can be injected, and the rate the client
+# actually sustained is reported: when the client falls behind, its socket fills up and the server waits.
+
+# Malformed events, cycled through when --malformed_every is set
+MALFORMED_EVENTS = (
+    '{"time": 1.0, "data": [[0.1, 0.2',
+    '{"data": [[0.1, 0.2, 0.3]]}',
+    '{"time": 1.0, "data": [[0.1, 0.2]]}',
+    'not json',
+)
+
+def load_events(path):
+    # Trajectory files by extension, anything else is read as a robot log
+    if path.endswith('.npz') or path.endswith('.json'):
+        return load_trajectory(path)
+    times, offsets, particles, _ = read_log_columns(path)
+    return Trajectory(times, offsets, particles[:, 0], particles[:, 1], particles[:, 2])
+
+def encode_particles(trajectory, particles=None):
+    # The "data" part of every event, encoded once. With particles set, each event's cloud is cycled or cut
+    # to particles - 1 entries, keeping the last particle (the desired pose) last.
+    x = trajectory.x.tolist()
+    y = trajectory.y.tolist()
+    t = [None if value != value else value for value in trajectory.t.tolist()]
+    offsets = trajectory.offsets.tolist()
+
+    encoded = []
+    for i in range(len(trajectory)):
+        indices = list(range(offsets[i], offsets[i + 1]))
+        if particles is not None and indices:
+            cloud, last = indices[:-1] or indices[-1:], indices[-1]
+            indices = [cloud[k % len(cloud)] for k in range(particles - 1)] + [last]
+        encoded.append(json.dumps([[x[j], y[j], t[j]] for j in indices]))
+    return encoded
+
+class ReplayServer:
+    # Event n (ids count from 1) is malformed if malformed_every divides n, so injected events don't take
+    # the place of recorded ones and an id always maps to the same event, also after a resume. With loop
+    # the recording repeats with its times shifted forward; otherwise the stream ends with the recording
+    # and later connections get 204 No Content, which tells SSE clients to stop reconnecting.
+    def __init__(self, trajectory, speed=1.0, particles=None, loop=False, malformed_every=0, disconnect_every=0,
+                 stall=False, chunked=False):
+        if len(trajectory) == 0:
+            raise ValueError("Nothing to replay")
+        self.times = trajectory.time.tolist()
+        self.data = encode_particles(trajectory, particles)
+        self.speed = speed
+        self.loop = loop
+        self.malformed_every = malformed_every
+        self.disconnect_every = disconnect_every
+        self.stall = stall
+        self.chunked = chunked
+
+        # Time between the last record and the first one of the next pass when looping
+        spacing = (self.times[-1] - self.times[0]) / max(len(self.times) - 1, 1)
+        self.period = self.times[-1] - self.times[0] + spacing
+
+        self.connections = 0
+        self.disconnects = 0
+        self.sent = 0
+        self.malformed = 0
+        self.bytes = 0
+        self.max_behind = 0.0
+
+    def total_events(self):
+        # Events in one pass, None if endless
+        if self.loop:
+            return None
+        records = len(self.times)
+        if not self.malformed_every:
+            return records
+        # The largest n with n - n // malformed_every == records, i.e. no malformed event after the last record
+        return records + (records - 1) // (self.malformed_every - 1) if self.malformed_every > 1 else None
+
+    def event(self, n):
+        # (stream time, data) of event n
+        if self.malformed_every and n % self.malformed_every == 0:
+            return None, MALFORMED_EVENTS[(n // self.malformed_every - 1) % len(MALFORMED_EVENTS)]
+
+        record = n - 1 - (n // self.malformed_every if self.malformed_every else 0)
+        passes, i = divmod(record, len(self.times))
+        time_stamp = self.times[i] + passes * self.period
+        return time_stamp, f'{{"time": {time_stamp!r}, "data": {self.data[i]}}}'
+
+    def frame(self, n, data):
+        event = f"id: {n}\ndata: {data}\n\n".encode()
+        if self.chunked:
+            return f"{len(event):x}\r\n".encode() + event + b"\r\n"
+        return event
+
+    async def handle(self, reader, writer):
+        # Read the request headers; only Last-Event-ID matters
+        last_event_id = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'last-event-id' and value.strip().isdigit():
+                last_event_id = int(value.strip())
+
+        total = self.total_events()
+        if total is not None and last_event_id >= total:
+            writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     + (b"Transfer-Encoding: chunked\r\n" if self.chunked else b"") + b"\r\n")
+        self.connections += 1
+        print(f"client connected (Last-Event-ID {last_event_id})", file=sys.stderr)
+
+        n = last_event_id
+        sent = 0
+        start = time.monotonic()
+        first_time = None
+        try:
+            while total is None or n < total:
+                n += 1
+                time_stamp, data = self.event(n)
+
+                # Real time (or speed times it) relative to the first event of this connection
+                if self.speed and time_stamp is not None:
+                    if first_time is None:
+                        first_time = time_stamp
+                    due = start + (time_stamp - first_time) / self.speed
+                    now = time.monotonic()
+                    if due > now:
+                        await asyncio.sleep(due - now)
+                    else:
+                        self.max_behind = max(self.max_behind, now - due)
+
+                frame = self.frame(n, data)
+                writer.write(frame)
+                # Waits while the client's socket is full, which is what limits the rate to what the client sustains
+                await writer.drain()
+                sent += 1
+                self.sent += 1
+                self.bytes += len(frame)
+                if time_stamp is None:
+                    self.malformed += 1
+                elif not self.speed and sent % 100 == 0:
+                    # drain() doesn't yield while the buffer has room, so let the reporter run
+                    await asyncio.sleep(0)
+
+                if self.disconnect_every and sent % self.disconnect_every == 0:
+                    self.disconnects += 1
+                    if self.stall:
+                        # Go quiet without closing, like a Wi-Fi blip; the client has to time out
+                        await reader.read()
+                    writer.transport.abort()
+                    return
+
+            if self.chunked:
+                writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            print("Replay finished", file=sys.stderr)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "disconnects": self.disconnects,
+            "sent": self.sent,
+            "malformed": self.malformed,
+            "megabytes": self.bytes / 1e6,
+            "max_behind_ms": self.max_behind * 1000,
+        }
+
+    async def report(self, interval):
+        # Print the counters and the rate the client sustained every interval seconds
+        last_sent, last_bytes = self.sent, self.bytes
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            elapsed = now - last_time
+            rate = (self.sent - last_sent) / elapsed
+            throughput = (self.bytes - last_bytes) / elapsed / 1e6
+            last_sent, last_bytes, last_time = self.sent, self.bytes, now
+            print(f"{rate:8.1f} events/s {throughput:6.2f} MB/s  " + "  ".join(
+                f"{name} {value:.1f}" if isinstance(value, float) else f"{name} {value}"
+                for name, value in self.stats().items()), file=sys.stderr)
+
+    async def serve(self, host, port, duration=None, report_interval=5.0):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Replaying {len(self.times)} records at http://{host}:{port}/uart0", file=sys.stderr)
+        reporter = asyncio.create_task(self.report(report_interval)) if report_interval else None
+        start = time.monotonic()
+        try:
+            async with server:
+                if duration is None:
+                    await server.serve_forever()
+                else:
+                    await asyncio.sleep(duration)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            elapsed = time.monotonic() - start
+            print(f"Sent {self.sent} events ({self.malformed} malformed), {self.bytes / 1e6:.1f} MB in {elapsed:.1f}s: "
+                  f"{self.sent / elapsed:.0f} events/s, {self.bytes / 1e6 / elapsed:.2f} MB/s sustained", file=sys.stderr)
+        return self.stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded log or trajectory file as the robot's SSE stream.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on; any path is served.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed relative to the recorded times; 0 sends as fast as the client reads.")
+    parser.add_argument("--particles", type=int, default=None, help="Particles per event, the recorded cloud cycled or cut to fit (the last, desired particle is kept).")
+    parser.add_argument("--loop", action="store_true", help="Repeat the recording endlessly with increasing times.")
+    parser.add_argument("--malformed_every", type=int, default=0, help="Make every Nth event malformed.")
+    parser.add_argument("--disconnect_every", type=int, default=0, help="Drop the connection after every N events sent on it.")
+    parser.add_argument("--stall", action="store_true", help="With --disconnect_every, stop sending but leave the connection open instead of closing it.")
+    parser.add_argument("--chunked", action="store_true", help="Send the stream with chunked transfer encoding.")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds instead of on Ctrl+C.")
+    parser.add_argument("--report_interval", type=float, default=5.0, help="Seconds between rate reports; 0 turns them off.")
+    parser.add_argument("recording", type=str, help="Robot log, or _processed .json/.npz file, to replay.")
+    args = parser.parse_args()
+
+    if args.particles is not None and args.particles < 1:
+        parser.error("--particles must be at least 1")
+    if args.malformed_every == 1:
+        parser.error("--malformed_every must be at least 2")
+
+    server = ReplayServer(load_events(args.recording), args.speed, args.particles, args.loop, args.malformed_every,
+                          args.disconnect_every, args.stall, args.chunked)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.duration, args.report_interval))
+    except KeyboardInterrupt:
+        print("Cntl+C, exiting", file=sys.stderr)
@@ -1,34 +1,30 @@
-import json
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import Trajectory, load_trajectory, save_trajectory
+
 if __name__ == "__main__":
     for arg in sys.argv[1:]:
-        with open(arg, 'r') as file:
-            xy_time_data = json.load(file)["data"]
-
-        # Lists to store localization and desired data
-        localization_data = []
-        desired_data = []
+        trajectory = load_trajectory(arg)
 
-        for data_point in xy_time_data:
-            loc_data = []
-            des_data = []
+        if (trajectory.counts() < 2).any():
+            raise ValueError(f"{arg}: every sample needs a localization and a desired position")
 
-            loc_data.append(data_point["data"][0])
-            des_data.append(data_point["data"][1])
+        # The first particle of every sample is the localization and the second one the desired position
+        starts = trajectory.offsets[:-1]
+        localization_data = Trajectory.from_points(trajectory.time, trajectory.x[starts], trajectory.y[starts], trajectory.t[starts])
+        desired_data = Trajectory.from_points(trajectory.time, trajectory.x[starts + 1], trajectory.y[starts + 1], trajectory.t[starts + 1])
 
-            localization_data.append({"time": data_point["time"], "data": loc_data})
-            desired_data.append({"time": data_point["time"], "data": des_data})
+        # Save the localization and desired data in the input's format (.json or .npz)
+        extension = os.path.splitext(arg)[1]
 
-        # Save the localization data to a JSON file
-        localization_file = f"{arg.split('.')[0]}_localization.json"
-        with open(localization_file, 'w') as json_file:
-            json.dump({"data": localization_data}, json_file, indent=4)
+        localization_file = f"{arg.split('.')[0]}_localization{extension}"
+        save_trajectory(localization_file, localization_data)
 
-        # Save the desired data to a JSON file
-        desired_file = f"{arg.split('.')[0]}_desired.json"
-        with open(desired_file, 'w') as json_file:
-            json.dump({"data": desired_data}, json_file, indent=4)
+        desired_file = f"{arg.split('.')[0]}_desired{extension}"
+        save_trajectory(desired_file, desired_data)
 
         print(f"Localization data saved to '{localization_file}'.")
-        print(f"Desired data saved to '{desired_file}'.")
\ No newline at end of file
+        print(f"Desired data saved to '{desired_file}'.")
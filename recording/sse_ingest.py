@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from trajectory_io import RecordWriter
+from online_split import SplitWriter
+
+# URL of the SSE endpoint
+sse_url = 'http://192.168.4.1/uart0'
+
+# Asyncio version of main.py that survives connection drops. The ingest stage only splits the raw stream
+# into events, timestamps them and queues them (and appends them to the raw log); JSON parsing happens in
+# a separate parse stage, so a slow parse never holds up reading the socket. After a drop it reconnects
+# with Last-Event-ID so the server can resume where the stream left off.
+
+def parse_event(data):
+    # Parse stage: turn an event's data into a record, ValueError for anything malformed
+    try:
+        message = json.loads(data)
+        return {"time": message["time"], "data": [{"x": item[0], "y": item[1], "t": item[2]} for item in message["data"]]}
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        raise ValueError(f"malformed event: {e}") from None
+
+async def open_stream(url, last_event_id, timeout):
+    # Plain HTTP/1.1 GET; returns the reader, the writer and whether the body is chunked
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+        raise ValueError(f"Only http:// SSE endpoints are supported, got {url}")
+
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    request = f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: text/event-stream\r\nCache-Control: no-cache\r\n"
+    if last_event_id is not None:
+        request += f"Last-Event-ID: {last_event_id}\r\n"
+    writer.write((request + "\r\n").encode('latin-1'))
+    await writer.drain()
+
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    status = status_line.split()
+    if len(status) < 2 or status[1] != b'200':
+        writer.close()
+        raise IOError(f"Unexpected response from {url}: {status_line.decode('latin-1').strip()}")
+
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+
+    return reader, writer, headers.get('transfer-encoding') == 'chunked'
+
+async def read_body(reader, chunked, idle_timeout):
+    # Yields the body in pieces as they arrive. A link that goes quiet for idle_timeout seconds counts
+    # as dropped, since a Wi-Fi blip often leaves the TCP connection hanging instead of closing it.
+    if not chunked:
+        while True:
+            data = await asyncio.wait_for(reader.read(65536), idle_timeout)
+            if not data:
+                return
+            yield data
+
+    while True:
+        size_line = await asyncio.wait_for(reader.readline(), idle_timeout)
+        if not size_line:
+            return
+        size = int(size_line.split(b';')[0], 16)
+        if size == 0:
+            return
+        data = await asyncio.wait_for(reader.readexactly(size + 2), idle_timeout)
+        yield data[:-2]
+
+class SSEIngest:
+    # Receives the SSE stream into a RecordWriter (see trajectory_io.py) and keeps counts of what happened:
+    #   received    events read off the stream
+    #   parsed      events stored in the output
+    #   malformed   events whose data was not a valid {"time", "data": [[x, y, t], ...]} message
+    #   dropped     events lost because the parse queue was full
+    #   missed      events the server numbered but we never saw (gaps in numeric event ids)
+    #   duplicates  events skipped because they repeat the last event or one seen earlier on the connection
+    #   unsplit     stored events the SplitWriter couldn't split (no localization particles, missing headings)
+    #   reconnects  times the connection was re-established after a drop
+    #
+    # With a SplitWriter (see online_split.py) the parse stage also writes the localization, desired and
+    # localization average outputs. Every valid record is stored first, so one that can't be split is still
+    # in the output and only counts as unsplit.
+    def __init__(self, url, writer, raw_log=None, queue_size=100000, retry=0.5, max_retry=5.0, timeout=5.0, split_writer=None):
+        self.url = url
+        self.writer = writer
+        self.split_writer = split_writer
+        self.raw_log = raw_log
+        self.retry = retry
+        self.max_retry = max_retry
+        self.timeout = timeout
+
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.stopped = False
+        self.last_event_id = None
+        self.last_numeric_id = None
+        # Numeric ids accepted on the current connection, to recognise repeats
+        self.recent_ids = deque(maxlen=1024)
+
+        self.received = 0
+        self.parsed = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.missed = 0
+        self.duplicates = 0
+        self.unsplit = 0
+        self.reconnects = 0
+        self.max_lag = 0.0
+
+    def _dispatch(self, event_id, data_lines):
+        # Fast path: no decoding here, just the receive time and the raw bytes
+        received_at = time.monotonic()
+        self.received += 1
+
+        if event_id is not None and event_id.isdigit():
+            number = int(event_id)
+            last = self.last_numeric_id
+            if last is not None:
+                if number == last or (number < last and number in self.recent_ids):
+                    self.duplicates += 1
+                    return
+                if number > last:
+                    self.missed += number - last - 1
+                # A lower id that wasn't seen on this connection means the server restarted its numbering
+                # (e.g. the robot rebooted), so count on from there
+            self.last_numeric_id = number
+            self.recent_ids.append(number)
+        if event_id is not None:
+            # Only accepted events move the resume point, so it never goes backwards past a repeat
+            self.last_event_id = event_id
+
+        data = b'\n'.join(data_lines)
+        if self.raw_log is not None:
+            self.raw_log.write(data + b'\n')
+
+        try:
+            self.queue.put_nowait((received_at, data))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _receive(self, reader, chunked):
+        buffer = b''
+        data_lines = []
+        event_id = None
+
+        async for piece in read_body(reader, chunked, self.timeout):
+            if self.stopped:
+                return
+            buffer += piece
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+
+            for line in lines:
+                if line.endswith(b'\r'):
+                    line = line[:-1]
+
+                if not line:
+                    # A blank line ends the event
+                    if data_lines:
+                        self._dispatch(event_id, data_lines)
+                    data_lines = []
+                    event_id = None
+                    continue
+
+                field, _, value = line.partition(b':')
+                if value.startswith(b' '):
+                    value = value[1:]
+                if field == b'data':
+                    data_lines.append(value)
+                elif field == b'id':
+                    event_id = value.decode('utf-8', 'replace')
+                elif field == b'retry' and value.isdigit():
+                    self.retry = int(value) / 1000
+                # Comments (empty field) and event names are ignored
+
+    async def ingest(self):
+        connected_once = False
+        delay = self.retry
+        while not self.stopped:
+            try:
+                reader, writer, chunked = await open_stream(self.url, self.last_event_id, self.timeout)
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                print(f"Could not connect to {self.url}: {e}; retrying in {delay:.1f}s", file=sys.stderr)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry)
+                continue
+
+            if connected_once:
+                self.reconnects += 1
+            self.recent_ids.clear()
+            connected_once = True
+            delay = self.retry
+            print("client connected", file=sys.stderr)
+
+            try:
+                await self._receive(reader, chunked)
+                print("Stream ended, reconnecting", file=sys.stderr)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                print(f"Connection lost ({type(e).__name__}: {e}), reconnecting", file=sys.stderr)
+            finally:
+                writer.close()
+
+            # A partial event from the dropped connection is discarded, as the SSE spec asks
+            await asyncio.sleep(self.retry)
+
+    def _parse(self, received_at, data):
+        try:
+            record = parse_event(data)
+        except ValueError:
+            self.malformed += 1
+            return
+        self.writer.append(record)
+        self.parsed += 1
+
+        if self.split_writer is not None:
+            try:
+                self.split_writer.append(record)
+            except (ValueError, TypeError):
+                self.unsplit += 1
+        self.max_lag = max(self.max_lag, time.monotonic() - received_at)
+
+    async def parse(self):
+        while True:
+            self._parse(*await self.queue.get())
+            # Hand control back to the ingest stage between events so a backlog never stalls the socket
+            await asyncio.sleep(0)
+
+    def drain(self):
+        # Parse whatever is still queued when the run stops
+        while not self.queue.empty():
+            self._parse(*self.queue.get_nowait())
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "parsed": self.parsed,
+            "malformed": self.malformed,
+            "dropped": self.dropped,
+            "missed": self.missed,
+            "duplicates": self.duplicates,
+            "unsplit": self.unsplit,
+            "reconnects": self.reconnects,
+            "queued": self.queue.qsize(),
+            "max_lag_ms": self.max_lag * 1000,
+        }
+
+    async def report(self, interval):
+        # Print the counters and the sustained event rate every interval seconds
+        last_received = self.received
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            rate = (self.received - last_received) / (now - last_time)
+            last_received, last_time = self.received, now
+            stats = self.stats()
+            print(f"{rate:8.1f} events/s  " + "  ".join(f"{name} {value:.1f}" if isinstance(value, float) else f"{name} {value}"
+                                                       for name, value in stats.items()), file=sys.stderr)
+
+    async def run(self, duration=None, report_interval=5.0):
+        # Runs until cancelled (Ctrl+C) or for duration seconds, then stores what is still queued
+        tasks = [asyncio.create_task(self.ingest()), asyncio.create_task(self.parse())]
+        if report_interval:
+            tasks.append(asyncio.create_task(self.report(report_interval)))
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            # wait_for() can swallow a cancel that lands just as its read completes, so the ingest loop also
+            # checks a flag
+            self.stopped = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.drain()
+        return self.stats()
+
+def process_sse_data(url, output, raw_log_path=None, duration=None, report_interval=5.0, queue_size=100000, split=False):
+    raw_log = open(raw_log_path, 'ab', buffering=0) if raw_log_path else None
+    writer = RecordWriter(output)
+    split_writer = SplitWriter(*os.path.splitext(output)) if split else None
+    ingest = SSEIngest(url, writer, raw_log=raw_log, queue_size=queue_size, split_writer=split_writer)
+
+    try:
+        asyncio.run(ingest.run(duration, report_interval))
+    except KeyboardInterrupt:
+        print("Cntl+C, exiting", file=sys.stderr)
+    finally:
+        writer.close()
+        if split_writer is not None:
+            split_writer.close()
+        if raw_log is not None:
+            raw_log.close()
+
+    print(json.dumps(ingest.stats()), file=sys.stderr)
+    print(f"x/y time data saved to '{output}'.")
+    return ingest.stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record the robot's SSE telemetry with automatic reconnect.")
+    parser.add_argument("--url", type=str, default=sse_url, help="SSE endpoint.")
+    parser.add_argument("--raw_log", type=str, default=None, help="Also append every event's raw data line to this file, in the format log.py reads.")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds instead of on Ctrl+C.")
+    parser.add_argument("--report_interval", type=float, default=5.0, help="Seconds between rate and counter reports; 0 turns them off.")
+    parser.add_argument("--split", action="store_true", help="Also write the localization, desired and localization average files log_split.py would make.")
+    parser.add_argument("--queue_size", type=int, default=100000, help="Events that may wait for the parse stage before new ones are dropped.")
+    parser.add_argument("output", type=str, nargs="?", default="xy_time_data.json", help="Output .json or .npz file.")
+    args = parser.parse_args()
+
+    process_sse_data(args.url, args.output, args.raw_log, args.duration, args.report_interval, args.queue_size, args.split)
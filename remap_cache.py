@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+import hashlib
+import os
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.remap_cache')
+
+# Build a single remap table that takes raw fisheye pixels straight to the field plane.
+# It is equivalent to fisheye.initUndistortRectifyMap + remap followed by warpPerspective with H.
+def build_fused_map(K, D, H, frame_size, balance=0.5, output_size=(2000, 2000)):
+    w, h = frame_size
+    out_w, out_h = output_size
+
+    # Same undistorted camera matrix the two-step pipeline uses
+    new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, D, (w, h), np.eye(3), balance=balance)
+
+    # Pull every field-plane pixel back through the homography into the undistorted image
+    ys, xs = np.mgrid[0:out_h, 0:out_w].astype(np.float64)
+    field = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2)
+    undistorted = cv2.perspectiveTransform(field, np.linalg.inv(H)).reshape(-1, 2)
+
+    # warpPerspective leaves pixels outside the undistorted frame black
+    outside = (undistorted[:, 0] < 0) | (undistorted[:, 0] > w - 1) | (undistorted[:, 1] < 0) | (undistorted[:, 1] > h - 1)
+
+    # Normalize with new_K and apply the fisheye distortion to land on raw camera pixels
+    normalized = (undistorted - new_K[:2, 2]) / np.array([new_K[0, 0], new_K[1, 1]])
+    raw = cv2.fisheye.distortPoints(normalized.reshape(-1, 1, 2), K, D).reshape(-1, 2)
+    raw[outside] = -1
+
+    map_x = raw[:, 0].reshape(out_h, out_w).astype(np.float32)
+    map_y = raw[:, 1].reshape(out_h, out_w).astype(np.float32)
+
+    # Fixed-point maps are half the size of float maps and faster to remap with
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+def fused_map_key(calibration_file, homography_file, frame_size, balance, output_size):
+    digest = hashlib.sha256()
+    for path in (calibration_file, homography_file):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    digest.update(repr((tuple(frame_size), float(balance), tuple(output_size))).encode())
+    return digest.hexdigest()
+
+# Load the fused map for this calibration from the cache directory, building and storing it on a miss.
+# Cached maps are memory-mapped so startup does not copy them and processes share the pages.
+def load_fused_map(calibration_file, homography_file, frame_size, balance=0.5, output_size=(2000, 2000), cache_dir=DEFAULT_CACHE_DIR):
+    key = fused_map_key(calibration_file, homography_file, frame_size, balance, output_size)
+    map1_path = os.path.join(cache_dir, f"{key}_map1.npy")
+    map2_path = os.path.join(cache_dir, f"{key}_map2.npy")
+
+    if os.path.exists(map1_path) and os.path.exists(map2_path):
+        return np.load(map1_path, mmap_mode='r'), np.load(map2_path, mmap_mode='r')
+
+    with np.load(calibration_file) as data:
+        K = data['K']
+        D = data['D']
+    with np.load(homography_file) as data:
+        H = data['H']
+
+    map1, map2 = build_fused_map(K, D, H, frame_size, balance, output_size)
+
+    # Write under a temporary name first so a concurrent reader never sees a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    for path, array in ((map1_path, map1), (map2_path, map2)):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.save(file, array)
+        os.replace(tmp_path, path)
+
+    return map1, map2
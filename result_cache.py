@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Persistent cache of computed results, one file per key in a directory. Keys are derived from the content
+# of the input files and the parameters, so an unchanged input hits the cache however it was named or
+# whenever it was touched, and any change to it misses. When the directory grows past max_bytes the least
+# recently used entries are removed (reads refresh an entry's modification time).
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(paths, parameters):
+    # parameters must be JSON serializable
+    description = json.dumps({"files": [file_digest(path) for path in paths], "parameters": parameters}, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+class ResultCache:
+    SUFFIX = '.pkl'
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        # The stored value, or None on a miss or an unreadable entry
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        # Written to a temporary file and renamed, so concurrent readers (e.g. other worker processes)
+        # never see a partial entry
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self._path(key))
+        except BaseException:
+            self._remove(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Drop the least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
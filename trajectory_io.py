@@ -0,0 +1,281 @@
+import argparse
+import json
+import os
+import struct
+import time
+import zipfile
+from array import array
+import numpy as np
+
+# Trajectories are stored column-wise: one time per sample, and the particles of every sample back to back
+# in x, y and t, with sample i owning particles offsets[i]:offsets[i + 1]. A missing heading (null in
+# JSON) is stored as NaN.
+#
+# .npz files are written uncompressed, so load_trajectory() memory-maps every column straight out of the
+# archive instead of reading it. .json files keep the original indent=4 layout,
+# {"data": [{"time": ..., "data": [{"x": ..., "y": ..., "t": ...}, ...]}, ...]}, and are the export format.
+
+COLUMNS = ('time', 'offsets', 'x', 'y', 't')
+
+JOURNAL_SUFFIX = '.ndjson'
+
+def _float_or_nan(value):
+    return float(value) if isinstance(value, (int, float)) else np.nan
+
+class Trajectory:
+    def __init__(self, time, offsets, x, y, t):
+        self.time = time
+        self.offsets = offsets
+        self.x = x
+        self.y = y
+        self.t = t
+
+    def __len__(self):
+        return len(self.time)
+
+    def counts(self):
+        # Number of particles in each sample
+        return np.diff(self.offsets)
+
+    def sample(self, i):
+        # x, y and t of every particle in sample i
+        particles = slice(self.offsets[i], self.offsets[i + 1])
+        return self.x[particles], self.y[particles], self.t[particles]
+
+    def first(self):
+        # x, y and t of the first particle of every sample, e.g. the position of a single-particle trajectory
+        starts = self.offsets[:-1]
+        return self.x[starts], self.y[starts], self.t[starts]
+
+    def records(self):
+        # The JSON record layout, with NaN headings turned back into null
+        offsets = self.offsets.tolist()
+        x = self.x.tolist()
+        y = self.y.tolist()
+        t = [None if value != value else value for value in self.t.tolist()]
+        return [{"time": time, "data": [{"x": x[j], "y": y[j], "t": t[j]} for j in range(offsets[i], offsets[i + 1])]}
+                for i, time in enumerate(self.time.tolist())]
+
+    @classmethod
+    def from_records(cls, records):
+        counts = [len(record["data"]) for record in records]
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        particles = [item for record in records for item in record["data"]]
+        return cls(
+            np.array([record["time"] for record in records], dtype=np.float64),
+            offsets,
+            np.array([_float_or_nan(item["x"]) for item in particles], dtype=np.float64),
+            np.array([_float_or_nan(item["y"]) for item in particles], dtype=np.float64),
+            np.array([_float_or_nan(item["t"]) for item in particles], dtype=np.float64),
+        )
+
+    @classmethod
+    def from_points(cls, time, x, y, t=None):
+        # One particle per sample
+        time = np.asarray(time, dtype=np.float64)
+        if t is None:
+            t = np.full(len(time), np.nan)
+        return cls(time, np.arange(len(time) + 1, dtype=np.int64), np.asarray(x, dtype=np.float64),
+                   np.asarray(y, dtype=np.float64), np.asarray(t, dtype=np.float64))
+
+def _memmap_npz(path):
+    # np.load() ignores mmap_mode for .npz archives, so find each stored .npy member and map its data directly
+    columns = {}
+    compressed = []
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                compressed.append(name)
+                continue
+
+            # The member starts after its local file header, whose name and extra field lengths vary
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if int(np.prod(shape)) == 0:
+                # Empty files can't be mapped
+                columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                columns[name] = np.memmap(f, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                          order='F' if fortran_order else 'C')
+
+    # Compressed members (np.savez_compressed) can't be mapped, so they are read from one open archive
+    if compressed:
+        with np.load(path) as data:
+            for name in compressed:
+                columns[name] = data[name]
+    return columns
+
+def load_trajectory(path):
+    if path.endswith('.npz'):
+        columns = _memmap_npz(path)
+        return Trajectory(*(columns[name] for name in COLUMNS))
+
+    with open(path, 'r') as file:
+        return Trajectory.from_records(json.load(file)["data"])
+
+def _json_float(value):
+    # How json.dump writes a float
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return float.__repr__(value)
+
+def _write_trajectory_json(json_file, trajectory, batch=1000):
+    # Writes exactly what json.dump({"data": trajectory.records()}, indent=4) would, straight from the
+    # columns: json.dump's pure-Python indent encoder is the slow part of exporting large trajectories
+    times = [_json_float(value) for value in trajectory.time.tolist()]
+    x = [_json_float(value) for value in trajectory.x.tolist()]
+    y = [_json_float(value) for value in trajectory.y.tolist()]
+    t = ['null' if value != value else _json_float(value) for value in trajectory.t.tolist()]
+    offsets = trajectory.offsets.tolist()
+
+    if not times:
+        json_file.write('{\n    "data": []\n}')
+        return
+
+    json_file.write('{\n    "data": [\n')
+    for first in range(0, len(times), batch):
+        samples = []
+        for i in range(first, min(first + batch, len(times))):
+            particles = range(offsets[i], offsets[i + 1])
+            if particles:
+                data = '[\n' + ',\n'.join(f'                {{\n                    "x": {x[j]},\n                    "y": {y[j]},\n'
+                                            f'                    "t": {t[j]}\n                }}' for j in particles) + '\n            ]'
+            else:
+                data = '[]'
+            samples.append(f'        {{\n            "time": {times[i]},\n            "data": {data}\n        }}')
+        json_file.write((',\n' if first else '') + ',\n'.join(samples))
+    json_file.write('\n    ]\n}')
+
+def save_trajectory(path, trajectory):
+    # .npz by extension, JSON otherwise
+    if path.endswith('.npz'):
+        np.savez(path, **{name: np.asarray(getattr(trajectory, name)) for name in COLUMNS})
+    else:
+        with open(path, 'w') as json_file:
+            _write_trajectory_json(json_file, trajectory)
+
+def _write_json_layout(path, records):
+    # Streams records into the same text json.dump({"data": records}, indent=4) would produce
+    with open(path, 'w') as json_file:
+        json_file.write('{\n    "data": [')
+        first = True
+        for record in records:
+            json_file.write('\n' if first else ',\n')
+            json_file.write('\n'.join('        ' + line for line in json.dumps(record, indent=4).split('\n')))
+            first = False
+        json_file.write('\n    ]\n}' if not first else ']\n}')
+
+def _read_journal(journal_path):
+    with open(journal_path, 'r') as journal:
+        for line in journal:
+            # A crash can leave the last line half written
+            if not line.endswith('\n'):
+                break
+            yield json.loads(line)
+
+def finalize_journal(journal_path, path=None):
+    # Turn a journal into the final .json or .npz file (by default the journal's name without .ndjson) and
+    # remove the journal. Also recovers the journal of a recording that crashed.
+    if path is None:
+        path = journal_path[:-len(JOURNAL_SUFFIX)]
+
+    if path.endswith('.npz'):
+        times = array('d')
+        counts = array('q')
+        columns = (array('d'), array('d'), array('d'))
+        for record in _read_journal(journal_path):
+            times.append(record["time"])
+            counts.append(len(record["data"]))
+            for item in record["data"]:
+                for column, name in zip(columns, ("x", "y", "t")):
+                    column.append(_float_or_nan(item[name]))
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(counts, dtype=np.int64), out=offsets[1:])
+        save_trajectory(path, Trajectory(np.frombuffer(times), offsets, *(np.frombuffer(column) for column in columns)))
+    else:
+        _write_json_layout(path, _read_journal(journal_path))
+
+    os.remove(journal_path)
+    return path
+
+class RecordWriter:
+    # Appends records to <path>.ndjson as they arrive, one JSON record per line, so a long recording
+    # keeps constant memory. Lines reach the OS as soon as they are written, so a crashed process loses
+    # nothing, and the journal is fsynced every flush_interval seconds to bound what a power loss can take.
+    # close() finalizes the journal into path (.json layout or .npz); a journal left over from a crash is
+    # finalized with `python trajectory_io.py --recover <path>.ndjson`.
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.flush_interval = flush_interval
+        self.count = 0
+
+        try:
+            self.journal = open(self.journal_path, 'x', buffering=1)
+        except FileExistsError:
+            raise FileExistsError(f"{self.journal_path} is left over from an unfinished run; recover it with "
+                                  f"python trajectory_io.py --recover {self.journal_path}") from None
+        self.last_sync = time.monotonic()
+
+    def append(self, record):
+        self.journal.write(json.dumps(record) + '\n')
+        self.count += 1
+        if time.monotonic() - self.last_sync >= self.flush_interval:
+            self.sync()
+
+    def append_point(self, time_stamp, x, y, t=None):
+        self.append({"time": time_stamp, "data": [{"x": x, "y": y, "t": t}]})
+
+    def sync(self):
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.journal.close()
+        return finalize_journal(self.journal_path, self.path)
+
+    def discard(self):
+        self.journal.close()
+        os.remove(self.journal_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # A run that failed before writing anything leaves no file behind; otherwise keep what was recorded
+        if exc_type is not None and self.count == 0:
+            self.discard()
+        else:
+            self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert trajectory files between JSON and the columnar .npz format.")
+    parser.add_argument("--to", type=str, default="npz", choices=["npz", "json"], help="Format to convert to.")
+    parser.add_argument("--recover", action="store_true", help="Finalize .ndjson journals left behind by an interrupted recording instead.")
+    parser.add_argument("files", type=str, nargs="+", help="Trajectory files to convert, e.g. videos/real/*.json.")
+    args = parser.parse_args()
+
+    for path in args.files:
+        if args.recover:
+            print(f"Recovered '{path}' into '{finalize_journal(path)}'.")
+            continue
+
+        output_path = os.path.splitext(path)[0] + "." + args.to
+        if output_path == path:
+            print(f"Skipping '{path}', already {args.to}")
+            continue
+        save_trajectory(output_path, load_trajectory(path))
+        print(f"Converted '{path}' to '{output_path}'.")
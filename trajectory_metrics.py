@@ -0,0 +1,169 @@
+import numpy as np
+from scipy.ndimage import binary_closing, binary_opening
+from alignment import wrap_angle
+
+# Localization error metrics over a reference and an estimate already on the same time grid (see
+# alignment.py). Per-sample quantities (position error, heading error, motion state) are computed once as
+# arrays, and every metric is a reduction of those arrays, so a new metric adds a reduction, not a pass
+# over the samples.
+#
+#   ate       absolute trajectory error: distance between the estimate and the reference at each time (both
+#             are in field coordinates already, so there is no rigid alignment first)
+#   rpe       relative pose error over a window: how far the estimate's displacement over the window is
+#             from the reference's, i.e. drift independent of any constant offset
+#   heading   wrapped difference between the headings, against the reference's recorded heading or, when
+#             it has none (the camera only tracks position), its direction of travel while moving. The robot
+#             drives both ways, so each stretch of driving (between stops, and between cusps where it turns
+#             from forwards to backwards) is taken as driven forwards or in reverse by which of the two most
+#             of the estimate's headings in it agree with, and compared against the direction of travel or
+#             its reverse accordingly. A heading that flips by pi within a stretch still counts as an error
+#             near pi. reverse_fraction is the share of the samples judged to be in reverse.
+#   heading_axis_folded
+#             without a recorded heading, also the error to the nearer of the two directions along the path
+#             at every sample, which hides any heading that is off by pi
+#   segments  error statistics for each stretch between the reference starting and stopping
+
+PERCENTILES = (50, 90, 95, 99)
+
+def error_stats(errors):
+    # Summary of absolute errors; NaN entries are ignored and an empty set gives None
+    errors = np.abs(errors[~np.isnan(errors)])
+    if len(errors) == 0:
+        return None
+    stats = {"samples": len(errors), "mean": float(errors.mean()), "rmse": float(np.sqrt(np.mean(errors**2))),
+             "max": float(errors.max())}
+    stats.update({f"p{p}": float(value) for p, value in zip(PERCENTILES, np.percentile(errors, PERCENTILES))})
+    return stats
+
+def window_pairs(time, interval, window):
+    # Indices n and m with time[m] - time[n] == window (to the grid), skipping pairs that straddle a gap
+    steps = max(int(round(window / interval)), 1)
+    start = np.arange(len(time) - steps)
+    end = start + steps
+    keep = np.abs(time[end] - time[start] - steps * interval) < interval / 2
+    return start[keep], end[keep]
+
+def motion(time, x, y, interval, window=0.5, min_speed=0.05, min_segment=0.25):
+    # Speed and direction of travel over a centred window, and whether the reference counts as moving.
+    # Stops and moves shorter than min_segment (e.g. passing through zero speed when reversing) are merged
+    # into the surrounding segment.
+    start, end = window_pairs(time, interval, window)
+    middle = (start + end) // 2
+    dx = x[end] - x[start]
+    dy = y[end] - y[start]
+
+    speed = np.full(len(time), np.nan)
+    direction = np.full(len(time), np.nan)
+    speed[middle] = np.hypot(dx, dy) / (time[end] - time[start])
+    direction[middle] = np.arctan2(dy, dx)
+
+    moving = speed > min_speed
+    width = max(int(round(min_segment / interval)), 1)
+    if width > 1 and len(moving):
+        # Padded with the end states so the ends of the trial aren't trimmed
+        padded = np.concatenate((np.full(width, moving[0]), moving, np.full(width, moving[-1])))
+        structure = np.ones(width, dtype=bool)
+        moving = binary_opening(binary_closing(padded, structure), structure)[width:-width]
+    return speed, direction, moving
+
+def run_ids(breaks):
+    # Splits len(breaks) + 1 samples into runs, with a new run after every True in breaks. Returns the run
+    # index of every sample and the runs' start and end indices.
+    boundaries = np.flatnonzero(breaks) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(breaks) + 1]))
+    return np.repeat(np.arange(len(starts)), ends - starts), starts, ends
+
+def travel_heading(t, direction, speed, moving, span):
+    # The direction of travel, or its reverse through every stretch of driving in which most of the
+    # estimate's headings point backwards; NaN while stopped. Stretches end where the robot stops or at a
+    # cusp, where it changes between driving forwards and backwards without stopping: the direction of
+    # travel turns by more than pi/2 from one sample to the next, or across span samples either side of a
+    # dip in speed. Also returns which samples are taken as reversing.
+    count = len(moving)
+    if count == 0:
+        return np.full(0, np.nan), np.zeros(0, dtype=bool)
+    turn = np.zeros(count - 1, dtype=bool)
+    turn |= np.abs(wrap_angle(np.diff(direction))) > np.pi / 2
+    if count > 2 * span + 1:
+        middle = np.arange(span, count - span)
+        dip = (speed[middle] <= speed[middle - 1]) & (speed[middle] < speed[middle + 1])
+        turned = np.abs(wrap_angle(direction[middle + span] - direction[middle - span])) > np.pi / 2
+        turn[middle[dip & turned]] = True
+    cusps = moving[1:] & moving[:-1] & turn
+    ids, starts, _ = run_ids((np.diff(moving.astype(np.int8)) != 0) | cusps)
+    backwards = np.abs(wrap_angle(t - direction)) > np.pi / 2
+    votes = moving & ~np.isnan(t) & ~np.isnan(direction)
+    reverse_votes = np.bincount(ids[votes], weights=backwards[votes], minlength=len(starts))
+    counts = np.bincount(ids[votes], minlength=len(starts))
+    reverse = moving & (reverse_votes > counts / 2)[ids]
+    return np.where(moving, wrap_angle(direction + np.where(reverse, np.pi, 0)), np.nan), reverse
+
+def segment_stats(time, errors, moving):
+    # Statistics of errors over each run of samples with the same motion state, reduced per run at once
+    if len(time) == 0:
+        return []
+    ids, starts, ends = run_ids(np.diff(moving.astype(np.int8)) != 0)
+
+    valid = ~np.isnan(errors)
+    counts = np.bincount(ids[valid], minlength=len(starts))
+    sums = np.bincount(ids[valid], weights=errors[valid], minlength=len(starts))
+    squares = np.bincount(ids[valid], weights=errors[valid]**2, minlength=len(starts))
+    maxima = np.maximum.reduceat(np.where(valid, errors, -np.inf), starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        rmse = np.sqrt(squares / counts)
+    return [{"start": float(time[s]), "end": float(time[e - 1]), "moving": bool(moving[s]), "samples": int(n),
+             "mean": float(mean), "rmse": float(r), "max": float(m) if n else float('nan')}
+            for s, e, n, mean, r, m in zip(starts, ends, counts, means, rmse, maxima)]
+
+def evaluate(time, reference, estimate, interval, rpe_windows=(1.0,), motion_window=0.5, min_speed=0.05, min_segment=0.25):
+    # reference and estimate are (x, y, t) arrays at the times in time, on a grid of the given interval
+    reference_x, reference_y, reference_t = reference
+    x, y, t = estimate
+
+    position_error = np.hypot(x - reference_x, y - reference_y)
+    speed, direction, moving = motion(time, reference_x, reference_y, interval, motion_window, min_speed, min_segment)
+
+    folded_error = None
+    reverse = None
+    if not np.isnan(reference_t).all():
+        heading_error, source = wrap_angle(t - reference_t), "recorded"
+    else:
+        span = max(int(round(motion_window / interval / 2)), 1)
+        travel, reverse = travel_heading(t, direction, speed, moving, span)
+        heading_error, source = wrap_angle(t - travel), "direction of travel"
+        # Error to the travel direction's axis, in [-pi/2, pi/2)
+        folded_error = wrap_angle(2 * (t - np.where(moving, direction, np.nan))) / 2
+
+    rpe = {}
+    for window in rpe_windows:
+        start, end = window_pairs(time, interval, window)
+        drift = np.hypot((x[end] - x[start]) - (reference_x[end] - reference_x[start]),
+                         (y[end] - y[start]) - (reference_y[end] - reference_y[start]))
+        rpe[f"{window:g}s"] = error_stats(drift)
+
+    heading = error_stats(heading_error)
+    if heading is not None:
+        heading["reference"] = source
+        if reverse is not None:
+            heading["reverse_fraction"] = float(reverse[~np.isnan(heading_error)].mean())
+    return {
+        "ate": error_stats(position_error),
+        "rpe": rpe,
+        "heading": heading,
+        "heading_axis_folded": error_stats(folded_error) if folded_error is not None else None,
+        "segments": segment_stats(time, position_error, moving),
+    }
+
+def flatten(metrics):
+    # The scalar metrics as one flat {column: value} row, e.g. ate_rmse, rpe_1s_p95, heading_axis_folded_mean
+    row = {}
+    for name, stats in (("ate", metrics["ate"]), ("heading", metrics["heading"]),
+                        ("heading_axis_folded", metrics["heading_axis_folded"]),
+                        *((f"rpe_{window}", stats) for window, stats in metrics["rpe"].items())):
+        for key, value in (stats or {}).items():
+            if key != "reference":
+                row[f"{name}_{key}"] = value
+    return row
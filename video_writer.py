@@ -0,0 +1,57 @@
+import cv2
+import queue
+import threading
+from profiling import timer
+
+class AsyncVideoWriter:
+    # Encodes frames on a dedicated thread fed by a bounded queue, so encoding does not stall decoding
+    # and detection. A full queue blocks submit(), which keeps memory bounded when encoding falls behind.
+    #
+    # Frames are submitted as renderers (see bright_object.py) and only rendered here, at 1/scale
+    # resolution and only for every Nth frame, so skipped or downscaled frames are never rendered in full.
+    def __init__(self, path, fps, frame_size=(2000, 2000), scale=1, every=1, draw=None, queue_size=8):
+        self.frame_size = frame_size
+        self.scale = scale
+        self.every = every
+        self.draw = draw
+
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.out = cv2.VideoWriter(path, fourcc, fps / every, (frame_size[0] // scale, frame_size[1] // scale))
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame_count, render, rect, position):
+        if frame_count % self.every:
+            return
+        if self.error is not None:
+            raise self.error
+        self.queue.put((render, rect, position))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.out.release()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # Keep draining so submit() never blocks forever after a failure
+                continue
+
+            try:
+                render, rect, position = item
+                frame = render(0, 0, *self.frame_size, scale=self.scale)
+                if self.draw is not None:
+                    self.draw(frame, rect, position, self.scale)
+                with timer.stage("encode"):
+                    self.out.write(frame)
+            except Exception as e:
+                self.error = e